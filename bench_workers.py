@@ -0,0 +1,135 @@
+"""Compare gunicorn worker profiles on the catalog, cart and checkout routes.
+
+Starts gunicorn once per profile (see gunicorn_config.py), drives it with
+concurrent logged-in clients and prints throughput and p99 per route:
+
+    python bench_workers.py --profiles sync,gthread --duration 30 --concurrency 32
+
+The app uses whatever MONGO_URI / STRIPE_* settings are in the environment,
+so point those at a local mongod and a Stripe stand-in rather than Atlas.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import re
+import signal
+import subprocess
+import sys
+import uuid
+
+import requests
+
+from loadgen import Recorder, run_workers, wait_for_server
+
+ROUTES = {
+    'catalog': ['GET /main', 'GET /products'],
+    'cart': ['POST /add_to_cart/<id>', 'GET /cart'],
+    'checkout': ['POST /create-checkout-session'],
+}
+
+
+def start_server(profile, port, workers=None, threads=None):
+    env = dict(os.environ)
+    env['GUNICORN_PROFILE'] = profile
+    env['GUNICORN_BIND'] = f'127.0.0.1:{port}'
+    env['GUNICORN_ACCESS_LOG'] = '/dev/null'
+    if workers:
+        env['GUNICORN_WORKERS'] = str(workers)
+    if threads:
+        env['GUNICORN_THREADS'] = str(threads)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'app:app'],
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env,
+    )
+
+
+def stop_server(process):
+    process.send_signal(signal.SIGTERM)
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def make_client(base_url, recorder):
+    """Return a factory for logged-in load workers."""
+
+    def make_worker(index):
+        session = requests.Session()
+        # Signing up also logs the session in
+        session.post(base_url + '/user/signup', data={
+            'name': f'Bench User {index}',
+            'email': f'bench-{uuid.uuid4().hex}@example.com',
+            'password': 'bench-password',
+        }, allow_redirects=False, timeout=30)
+        page = session.get(base_url + '/products', timeout=30).text
+        product_ids = re.findall(r'/add_to_cart/([^"]+)"', page)
+        if not product_ids:
+            raise RuntimeError('No products found at /products; seed the database first')
+        product_id = product_ids[index % len(product_ids)]
+
+        def step():
+            recorder.timed('GET /main', session, 'GET', base_url + '/main')
+            recorder.timed('GET /products', session, 'GET', base_url + '/products')
+            recorder.timed('POST /add_to_cart/<id>', session, 'POST', f'{base_url}/add_to_cart/{product_id}')
+            recorder.timed('GET /cart', session, 'GET', base_url + '/cart')
+            recorder.timed('POST /create-checkout-session', session, 'POST', base_url + '/create-checkout-session')
+
+        return step
+
+    return make_worker
+
+
+def bench_profile(profile, args):
+    base_url = f'http://127.0.0.1:{args.port}'
+    process = start_server(profile, args.port, args.workers, args.threads)
+    try:
+        wait_for_server(base_url)
+        recorder = Recorder()
+        elapsed = run_workers(args.concurrency, args.duration, make_client(base_url, recorder))
+        return recorder.report(elapsed)
+    finally:
+        stop_server(process)
+
+
+def print_report(results):
+    print(f"{'profile':<10} {'group':<9} {'route':<32} {'rps':>9} {'p50 ms':>9} {'p99 ms':>9} {'errors':>7}")
+    for profile, routes in results.items():
+        for group, labels in ROUTES.items():
+            for label in labels:
+                stats = routes.get(label)
+                if not stats:
+                    continue
+                print(f"{profile:<10} {group:<9} {label:<32} {stats['throughput_rps']:>9} "
+                      f"{stats['p50_ms']:>9} {stats['p99_ms']:>9} {stats['errors']:>7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', default='sync,gthread,gevent', help='comma separated gunicorn profiles')
+    parser.add_argument('--port', type=int, default=8100)
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per profile')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--workers', type=int, help='override the profile worker count')
+    parser.add_argument('--threads', type=int, help='override the gthread thread count')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    results = {}
+    for profile in args.profiles.split(','):
+        if profile == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print('Skipping gevent: install it with `pip install gevent`')
+            continue
+        print(f'Benchmarking {profile} for {args.duration:g}s with {args.concurrency} clients...')
+        results[profile] = bench_profile(profile, args)
+
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+"""In-process cache for catalog reads (products, categories, listings).
+
+Entries live in a bounded LRU with a TTL (CATALOG_CACHE_SIZE,
+CATALOG_CACHE_TTL_S). Every catalog write (add/remove product or category)
+calls invalidate(), which bumps a version number stored in the ``meta``
+collection and clears this worker's cache. Other workers compare their
+version with Mongo at most every CATALOG_VERSION_CHECK_S seconds and clear
+theirs when it moved, so a write shows up everywhere within that window
+instead of after the full TTL.
+
+The version document also keeps a short log of which products each write
+touched (changed_products()), so in-memory structures built from the whole
+catalog, like the search index, can catch up without reloading everything.
+
+The category list is kept apart from the LRU as one snapshot per process,
+so busy listings can never evict it. It is reloaded when the version moves or
+after CATEGORY_SNAPSHOT_TTL_S, and templates get it as ``categories`` from a
+context processor.
+
+Cached documents are shared between requests: copy before modifying them.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo import ReturnDocument
+from werkzeug.local import LocalProxy
+
+import product_ids
+from database import db
+
+settings = {
+    'CATALOG_CACHE_SIZE': 2048,
+    'CATALOG_CACHE_TTL_S': 60.0,
+    'CATALOG_VERSION_CHECK_S': 2.0,
+    'CATEGORY_SNAPSHOT_TTL_S': 30.0,
+}
+
+VERSION_ID = 'catalog'
+# Writes remembered in the version document's change log
+CHANGE_LOG_SIZE = 200
+
+
+class LRUCache:
+    """Thread-safe LRU with per-entry expiry and hit/miss counters."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        """(True, value) on a hit, (False, None) on a miss."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires, value = entry
+                if expires > now:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._data[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.maxsize,
+                'ttl_s': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+_cache = LRUCache(settings['CATALOG_CACHE_SIZE'], settings['CATALOG_CACHE_TTL_S'])
+_version = {'value': None, 'checked_at': 0.0, 'log': (None, [])}
+_version_lock = threading.Lock()
+
+
+def _sync_version():
+    """Clear the cache if another worker bumped the catalog version."""
+    now = time.monotonic()
+    if now - _version['checked_at'] < settings['CATALOG_VERSION_CHECK_S']:
+        return
+    with _version_lock:
+        if now - _version['checked_at'] < settings['CATALOG_VERSION_CHECK_S']:
+            return
+        doc = db.meta.find_one({'_id': VERSION_ID}) or {}
+        version = doc.get('version', 0)
+        if version != _version['value']:
+            _cache.clear()
+            _version['value'] = version
+        _version['log'] = (version, doc.get('changes', []))
+        _version['checked_at'] = now
+
+
+def version():
+    """The catalog version this worker's cache is at."""
+    _sync_version()
+    return _version['value']
+
+
+def cached(key, loader):
+    """Return the cached value for ``key``, calling ``loader()`` on a miss."""
+    _sync_version()
+    hit, value = _cache.get(key)
+    if not hit:
+        value = loader()
+        _cache.set(key, value)
+    return value
+
+
+def get_product(product_id):
+    """The product document for a string, ObjectId or legacy id, or None."""
+    product_id = str(product_id)
+    return cached(('product', product_id), lambda: product_ids.find_product(product_id))
+
+
+def get_products(ids):
+    """{id: product} for several ids; the ones not cached come from one query."""
+    _sync_version()
+    found, missing = {}, []
+    for product_id in map(str, ids):
+        hit, product = _cache.get(('product', product_id))
+        if hit:
+            if product:
+                found[product_id] = product
+        else:
+            missing.append(product_id)
+    loaded = product_ids.find_products(missing)
+    for product_id in missing:
+        _cache.set(('product', product_id), loaded.get(product_id))
+    found.update(loaded)
+    return found
+
+
+class CategorySnapshot:
+    """All categories, reloaded when the catalog version moves or the TTL ends."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.items = []
+        self.version = None
+        self.expires = 0.0
+        self.loads = 0
+
+    def get(self):
+        current = version()
+        if self.version == current and self.expires > time.monotonic():
+            return self.items
+        with self._lock:
+            if self.version != current or self.expires <= time.monotonic():
+                # Swapped in whole, so readers never see a half-built list
+                self.items = list(db.categories.find().sort('name', 1))
+                self.version = current
+                self.expires = time.monotonic() + settings['CATEGORY_SNAPSHOT_TTL_S']
+                self.loads += 1
+        return self.items
+
+
+_categories = CategorySnapshot()
+
+
+def get_categories():
+    """All categories sorted by name. Shared between requests: don't modify."""
+    return _categories.get()
+
+
+def inject_categories():
+    # Lazy, so pages that never show categories don't load them
+    return {'categories': LocalProxy(get_categories)}
+
+
+def invalidate(product_ids=None):
+    """Call after any catalog write: bumps the shared version and clears this worker.
+
+    ``product_ids`` lists the products the write added, changed or removed
+    (empty for category-only writes); None means it may have touched any.
+    """
+    entry = {'products': None if product_ids is None else [str(i) for i in product_ids]}
+    doc = db.meta.find_one_and_update(
+        {'_id': VERSION_ID},
+        {'$inc': {'version': 1}, '$push': {'changes': {'$each': [entry], '$slice': -CHANGE_LOG_SIZE}}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    with _version_lock:
+        _cache.clear()
+        _version['value'] = doc['version']
+        _version['log'] = (doc['version'], doc['changes'])
+        _version['checked_at'] = time.monotonic()
+
+
+def changed_products(since):
+    """(version, ids of products changed after version ``since``).
+
+    ids is None when the log doesn't reach back that far or a write didn't
+    say what it touched; reload everything then. One log entry is pushed per
+    version, so entry ``-n`` belongs to version ``version - n + 1``.
+    """
+    _sync_version()
+    version, changes = _version['log']
+    if since is None or version is None or version - since > len(changes):
+        return version, None
+    ids = set()
+    for entry in changes[len(changes) - max(version - since, 0):]:
+        if entry.get('products') is None:
+            return version, None
+        ids.update(entry['products'])
+    return version, ids
+
+
+def stats():
+    return dict(_cache.stats(), version=_version['value'], category_loads=_categories.loads,
+                categories=len(_categories.items))
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    _cache.maxsize = settings['CATALOG_CACHE_SIZE']
+    _cache.ttl = settings['CATALOG_CACHE_TTL_S']
+    app.context_processor(inject_categories)
@@ -0,0 +1,208 @@
+import os
+import threading
+
+from flask_pymongo import BSONObjectIdConverter, PyMongo
+from gridfs import GridFS
+from pymongo import MongoClient, monitoring
+from werkzeug.local import LocalProxy
+
+
+def _env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+
+# Connection settings; overridden from the Flask config by init_app()
+settings = {
+    'MONGO_URI': os.getenv('MONGO_URI'),
+    'MONGO_TLS': _env_flag('MONGO_TLS', 'true'),
+    'MONGO_MAX_POOL_SIZE': int(os.getenv('MONGO_MAX_POOL_SIZE', 20)),
+    'MONGO_MIN_POOL_SIZE': int(os.getenv('MONGO_MIN_POOL_SIZE', 0)),
+    'MONGO_MAX_IDLE_TIME_MS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', 60000)),
+    'MONGO_CONNECT_TIMEOUT_MS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    'MONGO_SOCKET_TIMEOUT_MS': int(os.getenv('MONGO_SOCKET_TIMEOUT_MS', 10000)),
+    'MONGO_SERVER_SELECTION_TIMEOUT_MS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    'MONGO_WAIT_QUEUE_TIMEOUT_MS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', 2000)),
+    'MONGO_POOL_STATS': _env_flag('MONGO_POOL_STATS', 'true'),
+    'MONGO_COMMAND_MONITOR': _env_flag('MONGO_COMMAND_MONITOR', 'true'),
+}
+
+_lock = threading.Lock()
+_client = None
+_db = None
+_fs = None
+_pool_stats = None
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events for the current process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+
+    def _bump(self, field, delta=1):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump('created')
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump('closed')
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._bump('checkout_failures')
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self._bump('checked_out', -1)
+
+    def snapshot(self):
+        with self._lock:
+            max_size = settings['MONGO_MAX_POOL_SIZE']
+            return {
+                'max_pool_size': max_size,
+                'open': self.created - self.closed,
+                'in_use': self.checked_out,
+                'saturation': (self.checked_out / max_size) if max_size else 0.0,
+                'connections_created': self.created,
+                'connections_closed': self.closed,
+                'checkouts': self.checkouts,
+                'checkout_failures': self.checkout_failures,
+            }
+
+
+def init_app(app):
+    """Copy the Mongo settings from the app config. Does not connect."""
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    app.url_map.converters['ObjectId'] = BSONObjectIdConverter
+
+
+def event_listeners():
+    """Listeners attached to the client when it is created."""
+    listeners = []
+    if settings['MONGO_POOL_STATS']:
+        listeners.append(_pool_stats)
+    if settings['MONGO_COMMAND_MONITOR']:
+        import mongo_monitor
+        listeners.append(mongo_monitor.listener)
+    return listeners
+
+
+def get_client():
+    """Return this process's MongoClient, creating it on first use.
+
+    The client is never created at import time, so under a prefork server
+    every worker opens its own pool after the fork.
+    """
+    global _client, _pool_stats
+    if _client is None:
+        with _lock:
+            if _client is None:
+                if not settings['MONGO_URI']:
+                    raise RuntimeError('MONGO_URI is not configured')
+                _pool_stats = PoolStats()
+                _client = MongoClient(
+                    settings['MONGO_URI'],
+                    tls=settings['MONGO_TLS'],
+                    retryWrites=True,
+                    w='majority',
+                    maxPoolSize=settings['MONGO_MAX_POOL_SIZE'],
+                    minPoolSize=settings['MONGO_MIN_POOL_SIZE'],
+                    maxIdleTimeMS=settings['MONGO_MAX_IDLE_TIME_MS'],
+                    connectTimeoutMS=settings['MONGO_CONNECT_TIMEOUT_MS'],
+                    socketTimeoutMS=settings['MONGO_SOCKET_TIMEOUT_MS'],
+                    serverSelectionTimeoutMS=settings['MONGO_SERVER_SELECTION_TIMEOUT_MS'],
+                    waitQueueTimeoutMS=settings['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+                    event_listeners=event_listeners(),
+                )
+    return _client
+
+
+def get_db():
+    """Return the default database named in MONGO_URI."""
+    global _db
+    if _db is None:
+        _db = get_client().get_database()
+    return _db
+
+
+def get_fs():
+    global _fs
+    if _fs is None:
+        _fs = GridFS(get_db())
+    return _fs
+
+
+def pool_stats():
+    """Pool usage for this process, or None if stats are off or not connected yet."""
+    if _pool_stats is None or not settings['MONGO_POOL_STATS']:
+        return None
+    return _pool_stats.snapshot()
+
+
+def _reset_after_fork():
+    # The parent's client (and its monitor threads) must not be reused in the
+    # child; drop the references so the first use creates a fresh pool.
+    global _lock, _client, _db, _fs, _pool_stats
+    _lock = threading.Lock()
+    _client = None
+    _db = None
+    _fs = None
+    _pool_stats = None
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class SharedPyMongo(PyMongo):
+    """Flask-PyMongo front end whose ``cx`` and ``db`` are the shared client."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app, uri=None, *args, **kwargs):
+        init_app(app)
+
+    @property
+    def cx(self):
+        return get_client()
+
+    @property
+    def db(self):
+        return get_db()
+
+
+# Lazy handles: importing these never touches the network
+mongo = SharedPyMongo()
+db = LocalProxy(get_db)
+fs = LocalProxy(get_fs)
@@ -1,6 +1,16 @@
-from flask import Blueprint, jsonify
+import os
+from flask import Blueprint, jsonify, current_app, request
 from bson import ObjectId
-from app import db
+import catalog_cache
+import database
+import fragments
+import mongo_monitor
+import page_cache
+import query_stats
+import search_index
+import trending
+from database import db
+from decorators import admin_required
 
 debug_bp = Blueprint('debug', __name__)
 
@@ -25,3 +35,78 @@ def debug_orders():
             'status': 'error',
             'message': str(e)
         }), 500
+
+
+@debug_bp.route('/pool')
+@admin_required
+def debug_pool():
+    """Connection pool usage for the worker that serves this request"""
+    return jsonify({
+        'status': 'success',
+        'pid': os.getpid(),
+        'pool': database.pool_stats()
+    })
+
+
+@debug_bp.route('/startup')
+@admin_required
+def debug_startup():
+    """How long app creation and the deferred first-request setup took"""
+    return jsonify({
+        'status': 'success',
+        'budget_ms': current_app.config['STARTUP_BUDGET_MS'],
+        'startup': current_app.extensions.get('startup')
+    })
+
+
+@debug_bp.route('/catalog-cache')
+@admin_required
+def debug_catalog_cache():
+    """Catalog, product card and page cache sizes and hit/miss counters for this worker"""
+    return jsonify({
+        'status': 'success',
+        'pid': os.getpid(),
+        'cache': catalog_cache.stats(),
+        'product_cards': fragments.stats(),
+        'pages': page_cache.stats()
+    })
+
+
+@debug_bp.route('/search-index')
+@admin_required
+def debug_search_index():
+    """Size and freshness of this worker's in-memory search index, and the most asked queries"""
+    return jsonify({
+        'status': 'success',
+        'pid': os.getpid(),
+        'index': search_index.index.stats(),
+        'head_queries': query_stats.head_queries(20)
+    })
+
+
+@debug_bp.route('/trending')
+@admin_required
+def debug_trending():
+    """Trending ranking state and the current top products with their scores"""
+    return jsonify({
+        'status': 'success',
+        'pid': os.getpid(),
+        'state': trending.stats(),
+        'top': [{'product_id': str(doc['_id']), 'score': doc['score']}
+                for doc in db.trending.find().sort('score', -1).limit(20)]
+    })
+
+
+@debug_bp.route('/queries')
+@admin_required
+def debug_queries():
+    """Mongo round trips and time per route for this worker (?reset=1 clears)"""
+    summary = mongo_monitor.route_summary()
+    if request.args.get('reset') == '1':
+        mongo_monitor.reset()
+    return jsonify({
+        'status': 'success',
+        'pid': os.getpid(),
+        'threshold': mongo_monitor.settings['MONGO_N_PLUS_ONE_THRESHOLD'],
+        'routes': summary
+    })
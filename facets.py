@@ -0,0 +1,143 @@
+"""Search facets: counts per category, price range and stock, plus filters.
+
+Filters come from the query string (``?category=Namkeen&price=50-100&in_stock=1``).
+Each facet is counted over the results with every *other* filter applied,
+so choosing a category still shows how many products each of the other
+categories has. The search index counts all facets in the same pass that
+collects its matches; on MongoDB one ``$facet`` aggregation returns them
+together.
+"""
+from math import inf
+
+# (key, label, lower bound, upper bound); bounds are in rupees, upper exclusive
+PRICE_BUCKETS = [
+    ('0-50', 'Under ₹50', 0, 50),
+    ('50-100', '₹50 – ₹100', 50, 100),
+    ('100-250', '₹100 – ₹250', 100, 250),
+    ('250-500', '₹250 – ₹500', 250, 500),
+    ('500-', '₹500 and above', 500, inf),
+]
+_BUCKETS = {key: (low, high) for key, _, low, high in PRICE_BUCKETS}
+NAMES = ('category', 'price', 'in_stock')
+
+
+def parse(args):
+    """Active filters from request args; unknown price ranges are ignored."""
+    filters = {}
+    if args.get('category'):
+        filters['category'] = args['category']
+    if args.get('price') in _BUCKETS:
+        filters['price'] = args['price']
+    if args.get('in_stock') == '1':
+        filters['in_stock'] = True
+    return filters
+
+
+def price_bucket(price):
+    if isinstance(price, bool) or not isinstance(price, (int, float)):
+        return None
+    for key, _, low, high in PRICE_BUCKETS:
+        if low <= price < high:
+            return key
+    return None
+
+
+def in_stock(product):
+    stock = product.get('stock')
+    return isinstance(stock, (int, float)) and stock > 0
+
+
+def _passes(product, name, value):
+    if name == 'category':
+        return product.get('category') == value
+    if name == 'price':
+        return price_bucket(product.get('price')) == value
+    return in_stock(product)
+
+
+class Counter:
+    """Counts facets one product at a time; ``add`` says whether it passes every filter."""
+
+    def __init__(self, filters):
+        self.filters = filters
+        self.categories = {}
+        self.prices = {}
+        self.in_stock = 0
+
+    def add(self, product):
+        failed = [name for name, value in self.filters.items() if not _passes(product, name, value)]
+        # Counted for a facet when only that facet's own filter (or none) rejects it
+        if not failed or failed == ['category']:
+            category = product.get('category')
+            if category:
+                self.categories[category] = self.categories.get(category, 0) + 1
+        if not failed or failed == ['price']:
+            bucket = price_bucket(product.get('price'))
+            if bucket:
+                self.prices[bucket] = self.prices.get(bucket, 0) + 1
+        if (not failed or failed == ['in_stock']) and in_stock(product):
+            self.in_stock += 1
+        return not failed
+
+    def result(self):
+        return build(self.categories, self.prices, self.in_stock, self.filters)
+
+
+def build(categories, prices, stocked, filters):
+    """The facets a template shows, with the active values marked."""
+    return {
+        'category': [{'value': name, 'label': name, 'count': count,
+                      'selected': filters.get('category') == name}
+                     for name, count in sorted(categories.items(), key=lambda item: (-item[1], item[0]))],
+        'price': [{'value': key, 'label': label, 'count': prices.get(key, 0),
+                   'selected': filters.get('price') == key}
+                  for key, label, _, _ in PRICE_BUCKETS if prices.get(key) or filters.get('price') == key],
+        'in_stock': {'count': stocked, 'selected': bool(filters.get('in_stock'))},
+    }
+
+
+# MongoDB ----------------------------------------------------------------------
+
+def _mongo_condition(name, value):
+    if name == 'category':
+        return {'category': value}
+    if name == 'price':
+        low, high = _BUCKETS[value]
+        return {'price': {'$gte': low, '$lt': high}} if high != inf else {'price': {'$gte': low}}
+    return {'stock': {'$gt': 0}}
+
+
+def mongo_filter(filters, skip=None):
+    """Query for ``filters`` (leaving out the one named ``skip``), or {} if none apply."""
+    conditions = [_mongo_condition(name, value) for name, value in filters.items() if name != skip]
+    return {'$and': conditions} if conditions else {}
+
+
+def mongo_facets(collection, query, filters):
+    """All facet counts for ``query`` in one aggregation."""
+    boundaries = [low for _, _, low, _ in PRICE_BUCKETS] + [inf]
+    pipeline = [
+        {'$match': query},
+        {'$facet': {
+            'category': [
+                {'$match': mongo_filter(filters, skip='category')},
+                {'$group': {'_id': '$category', 'count': {'$sum': 1}}},
+            ],
+            'price': [
+                {'$match': mongo_filter(filters, skip='price')},
+                {'$bucket': {'groupBy': '$price', 'boundaries': boundaries, 'default': 'other',
+                             'output': {'count': {'$sum': 1}}}},
+            ],
+            'in_stock': [
+                {'$match': {'$and': [mongo_filter(filters, skip='in_stock'), {'stock': {'$gt': 0}}]}},
+                {'$count': 'count'},
+            ],
+        }},
+    ]
+    result = next(collection.aggregate(pipeline), {})
+    categories = {doc['_id']: doc['count'] for doc in result.get('category', []) if doc['_id']}
+    # $bucket ids are the lower bounds
+    by_low = {low: key for key, _, low, _ in PRICE_BUCKETS}
+    prices = {by_low[doc['_id']]: doc['count'] for doc in result.get('price', []) if doc['_id'] in by_low}
+    stocked = result['in_stock'][0]['count'] if result.get('in_stock') else 0
+    return build(categories, prices, stocked, filters)
@@ -0,0 +1,333 @@
+"""Local stand-in for the Stripe API endpoints the checkout flow uses.
+
+Implements just enough of the API for create_checkout_session, success and
+debug_session:
+
+    POST /v1/checkout/sessions
+    GET  /v1/checkout/sessions/<id>
+    GET  /v1/checkout/sessions/<id>/line_items
+    GET  /v1/customers/<id>
+
+Sessions are created already paid. Point the app at it with
+STRIPE_API_BASE=http://127.0.0.1:12111 (any STRIPE_SECRET_KEY will do):
+
+    python fake_stripe.py --port 12111
+
+Real Stripe calls take a few hundred milliseconds and occasionally fail, and
+the app makes them synchronously inside a worker. --latency-ms/--jitter-ms
+delay every response and --error-rate answers that fraction of requests with
+one of --error-statuses, using Stripe's error bodies:
+
+    python fake_stripe.py --latency-ms 300 --jitter-ms 150 --error-rate 0.02 --error-statuses 500,429
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+def _new_id(prefix):
+    return f'{prefix}_test_{uuid.uuid4().hex[:24]}'
+
+
+def parse_form(body):
+    """Decode Stripe's bracketed form encoding into nested dicts and lists.
+
+    ``line_items[0][price_data][unit_amount]=500`` becomes
+    ``{'line_items': [{'price_data': {'unit_amount': '500'}}]}``.
+    """
+    root = {}
+    for key, value in parse_qsl(body, keep_blank_values=True):
+        parts = re.findall(r'[^\[\]]+', key)
+        node = root
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+        node[parts[-1]] = value
+    return _listify(root)
+
+
+def _listify(node):
+    if not isinstance(node, dict):
+        return node
+    node = {k: _listify(v) for k, v in node.items()}
+    if node and all(k.isdigit() for k in node):
+        return [node[k] for k in sorted(node, key=int)]
+    return node
+
+
+class FakeStripe:
+    """In-memory checkout sessions, customers and line items."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sessions = {}
+        self.line_items = {}
+        self.customers = {}
+
+    def create_session(self, params):
+        line_items = []
+        for item in params.get('line_items', []):
+            price_data = item.get('price_data', {})
+            product_data = price_data.get('product_data', {})
+            quantity = int(item.get('quantity', 1))
+            unit_amount = int(price_data.get('unit_amount', 0))
+            line_items.append({
+                'id': _new_id('li'),
+                'object': 'item',
+                'description': product_data.get('name', 'Product'),
+                'quantity': quantity,
+                'amount_subtotal': unit_amount * quantity,
+                'amount_total': unit_amount * quantity,
+                'currency': price_data.get('currency', 'usd'),
+                'price': {
+                    'id': _new_id('price'),
+                    'object': 'price',
+                    'unit_amount': unit_amount,
+                    'product': _new_id('prod'),
+                    'metadata': product_data.get('metadata', {}),
+                },
+            })
+
+        customer = {
+            'id': _new_id('cus'),
+            'object': 'customer',
+            'email': f'{uuid.uuid4().hex[:12]}@example.com',
+            'name': 'Test Customer',
+        }
+        session = {
+            'id': _new_id('cs'),
+            'object': 'checkout.session',
+            'mode': params.get('mode', 'payment'),
+            'status': 'complete',
+            'payment_status': 'paid',
+            'payment_intent': _new_id('pi'),
+            'amount_total': sum(item['amount_total'] for item in line_items),
+            'currency': 'usd',
+            'customer': customer['id'],
+            'customer_email': customer['email'],
+            'customer_details': {'email': customer['email'], 'name': customer['name'], 'phone': '+15555550100'},
+            'shipping': {
+                'name': customer['name'],
+                'address': {
+                    'line1': '1 Test Street',
+                    'line2': '',
+                    'city': 'Toronto',
+                    'state': 'ON',
+                    'postal_code': 'M5V 2T6',
+                    'country': 'CA',
+                },
+            },
+            'metadata': params.get('metadata', {}),
+            'success_url': params.get('success_url'),
+            'cancel_url': params.get('cancel_url'),
+        }
+        with self._lock:
+            self.sessions[session['id']] = session
+            self.line_items[session['id']] = line_items
+            self.customers[customer['id']] = customer
+        return session
+
+    def get_session(self, session_id, expand=()):
+        with self._lock:
+            session = self.sessions.get(session_id)
+            if session is None:
+                return None
+            session = dict(session)
+            if 'line_items' in expand:
+                session['line_items'] = self._list(session_id)
+        return session
+
+    def _list(self, session_id):
+        return {
+            'object': 'list',
+            'url': f'/v1/checkout/sessions/{session_id}/line_items',
+            'has_more': False,
+            'data': self.line_items.get(session_id, []),
+        }
+
+    def list_line_items(self, session_id):
+        with self._lock:
+            if session_id not in self.sessions:
+                return None
+            return self._list(session_id)
+
+    def get_customer(self, customer_id):
+        with self._lock:
+            return self.customers.get(customer_id)
+
+
+def _not_found(kind, object_id):
+    return 404, {'error': {
+        'type': 'invalid_request_error',
+        'code': 'resource_missing',
+        'message': f"No such {kind}: '{object_id}'",
+    }}
+
+
+_ERRORS = {
+    400: ('invalid_request_error', None, 'Injected invalid request.'),
+    402: ('card_error', 'card_declined', 'Your card was declined.'),
+    429: ('invalid_request_error', 'rate_limit', 'Too many requests hit the API too quickly.'),
+    500: ('api_error', None, 'An unknown error occurred.'),
+    502: ('api_error', None, 'Bad gateway.'),
+    503: ('api_error', None, 'The service is temporarily unavailable.'),
+}
+
+
+class Faults:
+    """Latency and error injection applied to every request."""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, error_statuses=(500,)):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses) or (500,)
+        for status in self.error_statuses:
+            if status not in _ERRORS:
+                raise ValueError(f'Unsupported error status {status}; pick from {sorted(_ERRORS)}')
+
+    def delay(self):
+        delay_ms = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def error(self):
+        """A (status, payload) error to send instead of the real answer, or None."""
+        if not self.error_rate or random.random() >= self.error_rate:
+            return None
+        status = random.choice(self.error_statuses)
+        error_type, code, message = _ERRORS[status]
+        error = {'type': error_type, 'message': message}
+        if code:
+            error['code'] = code
+        return status, {'error': error}
+
+    def as_dict(self):
+        return {
+            'latency_ms': self.latency_ms,
+            'jitter_ms': self.jitter_ms,
+            'error_rate': self.error_rate,
+            'error_statuses': list(self.error_statuses),
+        }
+
+
+def parse_statuses(value):
+    try:
+        statuses = tuple(int(s) for s in value.split(',') if s.strip())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f'expected comma-separated status codes, got {value!r}')
+    unsupported = [s for s in statuses if s not in _ERRORS]
+    if unsupported:
+        raise argparse.ArgumentTypeError(f'unsupported status {unsupported[0]}; pick from {sorted(_ERRORS)}')
+    return statuses
+
+
+def make_handler(stripe, faults=None):
+    faults = faults or Faults()
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+        # Headers and body go out in separate writes; with Nagle on, keep-alive
+        # clients wait ~40ms for a delayed ACK on every call
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.send_header('Request-Id', _new_id('req'))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def route(self, method):
+            url = urlsplit(self.path)
+            query = parse_form(url.query)
+            path = url.path.rstrip('/')
+
+            if method == 'POST' and path == '/v1/checkout/sessions':
+                length = int(self.headers.get('Content-Length', 0))
+                params = parse_form(self.rfile.read(length).decode())
+                return 200, stripe.create_session(params)
+
+            match = re.fullmatch(r'/v1/checkout/sessions/([^/]+)', path)
+            if method == 'GET' and match:
+                session = stripe.get_session(match.group(1), expand=query.get('expand', []))
+                return (200, session) if session else _not_found('checkout.session', match.group(1))
+
+            match = re.fullmatch(r'/v1/checkout/sessions/([^/]+)/line_items', path)
+            if method == 'GET' and match:
+                items = stripe.list_line_items(match.group(1))
+                return (200, items) if items else _not_found('checkout.session', match.group(1))
+
+            match = re.fullmatch(r'/v1/customers/([^/]+)', path)
+            if method == 'GET' and match:
+                customer = stripe.get_customer(match.group(1))
+                return (200, customer) if customer else _not_found('customer', match.group(1))
+
+            return 404, {'error': {'type': 'invalid_request_error', 'message': f'Unrecognized request URL ({method}: {path})'}}
+
+        def handle_method(self, method):
+            faults.delay()
+            error = faults.error()
+            if error is not None:
+                # Drain the body so the keep-alive connection stays usable
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._send(*error)
+            else:
+                self._send(*self.route(method))
+
+        def do_GET(self):
+            self.handle_method('GET')
+
+        def do_POST(self):
+            self.handle_method('POST')
+
+    return Handler
+
+
+def start(host='127.0.0.1', port=12111, faults=None):
+    """Serve in a background thread; returns the server (call shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(FakeStripe(), faults))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='fake-stripe', daemon=True).start()
+    return server
+
+
+def add_fault_arguments(parser):
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every Stripe response')
+    parser.add_argument('--jitter-ms', type=float, default=0, help='random +/- spread around --latency-ms')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of Stripe requests that fail')
+    parser.add_argument('--error-statuses', type=parse_statuses, default=(500,),
+                        help=f'comma-separated statuses for injected errors, from {sorted(_ERRORS)}')
+
+
+def faults_from_args(args):
+    return Faults(args.latency_ms, args.jitter_ms, args.error_rate, args.error_statuses)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=12111)
+    add_fault_arguments(parser)
+    args = parser.parse_args()
+    server = start(args.host, args.port, faults_from_args(args))
+    print(f'Fake Stripe listening on http://{args.host}:{args.port}')
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
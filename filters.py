@@ -1,7 +1,17 @@
+import re
 from datetime import datetime
 from flask import current_app
 
+
+def slugify(name):
+    """URL slug for a category name: 'Dry  Fruits' -> 'dry-fruits'."""
+    return re.sub(r'[-\s]+', '-', name.strip().lower())
+
+
 def init_app(app):
+    # For documents saved before categories had a stored slug
+    app.template_filter('slugify')(slugify)
+
     @app.template_filter('datetimeformat')
     def datetimeformat(value, format='%b %d, %Y'):
         if not value:
@@ -33,3 +43,10 @@ def init_app(app):
         except Exception as e:
             current_app.logger.error(f'Error formatting date {value}: {str(e)}')
             return str(value)
+
+    @app.template_filter('timestampformat')
+    def timestampformat(value, format='%b %d, %Y %H:%M:%S'):
+        try:
+            return datetime.utcfromtimestamp(value).strftime(format)
+        except (TypeError, ValueError, OverflowError):
+            return str(value)
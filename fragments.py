@@ -0,0 +1,56 @@
+"""Cache of rendered product cards.
+
+Listing pages show up to PRODUCTS_PAGE_SIZE cards each, and rendering them
+through the ``product_card`` macro is most of the template time on the
+busiest pages. Each worker keeps the rendered HTML of a card in an LRU of
+FRAGMENT_CACHE_SIZE entries keyed by product id and the product's
+``version`` field, and templates assemble listings from it with
+``{{ product_cards(products) }}``.
+
+Anything that changes a product must bump its version
+(``{'$inc': {'version': 1}}``) in the same update, or cards keep showing
+the old name, price or image until they drop out of the cache.
+"""
+from flask import current_app
+from markupsafe import Markup
+
+from catalog_cache import LRUCache
+
+settings = {
+    'FRAGMENT_CACHE_SIZE': 10000,
+    'FRAGMENT_CACHE_TTL_S': 3600.0,
+}
+
+_cache = LRUCache(settings['FRAGMENT_CACHE_SIZE'], settings['FRAGMENT_CACHE_TTL_S'])
+
+
+def _render(product):
+    macro = current_app.jinja_env.get_template('macros.html').module.product_card
+    return Markup(macro(product))
+
+
+def product_card(product):
+    """One card's HTML, rendered at most once per product version."""
+    key = (str(product['_id']), product.get('version', 0))
+    hit, html = _cache.get(key)
+    if not hit:
+        html = _render(product)
+        _cache.set(key, html)
+    return html
+
+
+def product_cards(products):
+    return Markup(''.join(product_card(product) for product in products))
+
+
+def stats():
+    return _cache.stats()
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    _cache.maxsize = settings['FRAGMENT_CACHE_SIZE']
+    _cache.ttl = settings['FRAGMENT_CACHE_TTL_S']
+    app.add_template_global(product_cards)
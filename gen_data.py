@@ -0,0 +1,254 @@
+"""Bulk-generate a production-sized catalog and order history.
+
+Documents match what the app writes: products with UUID string _ids (as
+add_product creates) mixed with ObjectIds and literal string ids, GridFS
+main images, users, and orders with display_total and shipping_info like the
+ones success() stores. Ids are derived from the run id and the row number, so
+parallel workers can generate orders that point at products and users made
+by other workers.
+
+    python gen_data.py --products 1000000 --users 200000 --orders 2000000 --workers 8
+
+Refuses to write to a non-local MongoDB unless --allow-remote is given.
+"""
+import argparse
+import hashlib
+import os
+import random
+import struct
+import time
+import uuid
+import zlib
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+from urllib.parse import urlsplit
+
+from bson.objectid import ObjectId
+from gridfs import GridFS
+from pymongo import MongoClient
+
+from filters import slugify
+from loadtest import LOCAL_HOSTS
+
+
+SNACKS = [
+    'Aloo Bhujia', 'Bhujiya Sev', 'Moong Dal', 'Chakli', 'Khakhra', 'Mathri', 'Namak Para',
+    'Soan Papdi', 'Kaju Katli', 'Besan Ladoo', 'Chivda', 'Banana Chips', 'Murukku', 'Gathiya',
+    'Shakarpara', 'Rasgulla', 'Gulab Jamun', 'Peanut Chikki', 'Masala Peanuts', 'Papdi',
+]
+STYLES = ['Classic', 'Spicy', 'Masala', 'Homestyle', 'Crispy', 'Roasted', 'Sweet', 'Tangy', 'Royal', 'Jain']
+SIZES = ['150g', '200g', '400g', '500g', '1kg']
+CATEGORY_BASES = ['Namkeen', 'Sweets', 'Dry Fruits', 'Festive Boxes', 'Healthy Snacks', 'Chips',
+                  'Biscuits', 'Pickles', 'Ready To Eat', 'Beverages']
+CITIES = [('Toronto', 'ON', 'CA'), ('Mumbai', 'MH', 'IN'), ('London', 'LDN', 'GB'), ('Austin', 'TX', 'US')]
+STATUSES = ['Order Placed', 'Order Confirmed', 'Order Processing', 'Shipped', 'In Transit', 'Delivered']
+
+
+def _object_id(seed):
+    return ObjectId(hashlib.md5(seed.encode()).digest()[:12])
+
+
+def category_name(i):
+    base = CATEGORY_BASES[i % len(CATEGORY_BASES)]
+    return base if i < len(CATEGORY_BASES) else f'{base} {i // len(CATEGORY_BASES) + 1}'
+
+
+def product_id(run, i):
+    # Mostly UUID strings like add_product, some ObjectIds, a few literal ids
+    kind = i % 20
+    if kind < 3:
+        return _object_id(f'{run}-product-{i}')
+    if kind == 3:
+        return f'sku-{run}-{i}'
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f'{run}-product-{i}'))
+
+
+def user_id(run, i):
+    if i % 10 == 0:
+        return _object_id(f'{run}-user-{i}')
+    return uuid.uuid5(uuid.NAMESPACE_URL, f'{run}-user-{i}').hex
+
+
+def make_product(run, i, categories, images):
+    rng = random.Random(f'{run}-product-{i}')
+    image = images[i % len(images)] if images else 'placeholder'
+    return {
+        '_id': product_id(run, i),
+        'name': f'{rng.choice(STYLES)} {rng.choice(SNACKS)} {rng.choice(SIZES)}',
+        'price': round(rng.uniform(0.99, 49.99), 2),
+        'stock': rng.choice([0] + [rng.randint(1, 500)] * 9),
+        'description': f'{rng.choice(STYLES)} {rng.choice(SNACKS).lower()} made in small batches. ' * rng.randint(1, 4),
+        'main_image': {'id': image, 'content_type': 'image/png'},
+        'additional_images': [{'id': images[(i + k) % len(images)], 'content_type': 'image/png'}
+                              for k in range(1, rng.randint(1, 3))] if images else [],
+        'video': None,
+        'category': category_name(rng.randrange(categories)),
+    }
+
+
+def make_user(run, i, password_hash):
+    return {
+        '_id': user_id(run, i),
+        'name': f'Customer {i}',
+        'email': f'customer{i}.{run}@example.com',
+        'password': password_hash,
+    }
+
+
+def make_order(run, i, products, users, categories, days):
+    rng = random.Random(f'{run}-order-{i}')
+    customer = rng.randrange(users)
+    items = []
+    for _ in range(rng.randint(1, 5)):
+        j = rng.randrange(products)
+        product = make_product(run, j, categories, [])
+        quantity = rng.randint(1, 4)
+        items.append({
+            'product_id': str(product['_id']),
+            'name': product['name'],
+            'price': round(product['price'] * quantity, 2),
+            'quantity': quantity,
+        })
+    total = round(sum(item['price'] for item in items), 2)
+    email = f'customer{customer}.{run}@example.com'
+    city, state, country = rng.choice(CITIES)
+    return {
+        'user_id': str(user_id(run, customer)),
+        'items': items,
+        'total': total,
+        'display_total': f'₹{total:.2f}',
+        'status': rng.choice(STATUSES),
+        'payment_intent': f'pi_{run}_{i}',
+        'created_at': datetime.utcnow() - timedelta(seconds=rng.randrange(days * 86400)),
+        'shipping_info': {
+            'name': f'Customer {customer}',
+            'email': email,
+            'address': {
+                'line1': f'{rng.randint(1, 999)} Market Street',
+                'line2': '',
+                'city': city,
+                'state': state,
+                'postal_code': f'{rng.randint(10000, 99999)}',
+                'country': country,
+            },
+            'phone': f'+1555{rng.randint(1000000, 9999999)}',
+        },
+        'email': email,
+        'user_name': f'Customer {customer}',
+        'user_email': email,
+        'checkout_email': email,
+        'stripe_customer_id': f'cus_{run}_{i}',
+    }
+
+
+def _insert_chunk(task):
+    """Pool worker: build and insert rows [start, end) of one collection."""
+    kind, start, end, opts = task
+    client = MongoClient(opts['mongo_uri'])
+    db = client.get_database()
+    batch = []
+    for i in range(start, end):
+        if kind == 'products':
+            batch.append(make_product(opts['run'], i, opts['categories'], opts['images']))
+        elif kind == 'users':
+            batch.append(make_user(opts['run'], i, opts['password_hash']))
+        else:
+            batch.append(make_order(opts['run'], i, opts['products'], opts['users'],
+                                    opts['categories'], opts['days']))
+        if len(batch) >= opts['batch_size']:
+            db[kind].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db[kind].insert_many(batch, ordered=False)
+    client.close()
+    return kind, end - start
+
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+
+def make_png(rgb, size=64):
+    """A valid ``size`` x ``size`` PNG filled with one RGB colour."""
+    row = b'\x00' + bytes(rgb) * size  # filter byte, then the pixels
+    return (b'\x89PNG\r\n\x1a\n'
+            + _png_chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + _png_chunk(b'IDAT', zlib.compress(row * size))
+            + _png_chunk(b'IEND', b''))
+
+
+def make_images(db, count):
+    """Store ``count`` distinct PNGs in GridFS and return their ids."""
+    fs = GridFS(db)
+    # A different colour per image keeps the files distinct
+    return [str(fs.put(make_png(random.Random(f'image-{i}').randbytes(3)),
+                       filename=f'generated-{i}.png', content_type='image/png'))
+            for i in range(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('LOADTEST_MONGO_URI', 'mongodb://localhost:27017/shimplyshop_loadtest'))
+    parser.add_argument('--allow-remote', action='store_true', help='allow a non-local MongoDB')
+    parser.add_argument('--products', type=int, default=10000)
+    parser.add_argument('--categories', type=int, default=20)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--orders', type=int, default=20000)
+    parser.add_argument('--images', type=int, default=50, help='distinct GridFS images shared by the products')
+    parser.add_argument('--days', type=int, default=365, help='spread order dates over this many days')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--run-id', default=uuid.uuid4().hex[:8], help='prefix that keeps ids unique per run')
+    parser.add_argument('--drop', action='store_true', help='empty the collections first')
+    args = parser.parse_args()
+
+    if urlsplit(args.mongo_uri).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error(f'{args.mongo_uri} is not a local MongoDB; pass --allow-remote to use it anyway')
+    if args.orders and (args.products < 1 or args.users < 1):
+        parser.error('orders need at least one product and one user')
+
+    client = MongoClient(args.mongo_uri)
+    db = client.get_database()
+    if args.drop:
+        for name in ('products', 'categories', 'users', 'orders', 'fs.files', 'fs.chunks'):
+            db.drop_collection(name)
+
+    started = time.time()
+    existing = {c['name'] for c in db.categories.find({}, {'name': 1})}
+    new_categories = [{'name': category_name(i), 'slug': slugify(category_name(i))}
+                      for i in range(args.categories) if category_name(i) not in existing]
+    if new_categories:
+        db.categories.insert_many(new_categories)
+    images = make_images(db, args.images)
+
+    from passlib.hash import pbkdf2_sha256
+    opts = {
+        'mongo_uri': args.mongo_uri,
+        'run': args.run_id,
+        'categories': args.categories,
+        'images': images,
+        'products': args.products,
+        'users': args.users,
+        'days': args.days,
+        'batch_size': args.batch_size,
+        # Hashing is slow, so every generated user shares one password
+        'password_hash': pbkdf2_sha256.hash('password123'),
+    }
+
+    chunk = args.batch_size * 10
+    tasks = []
+    for kind, total in (('products', args.products), ('users', args.users), ('orders', args.orders)):
+        tasks += [(kind, start, min(start + chunk, total), opts) for start in range(0, total, chunk)]
+
+    done = {'products': 0, 'users': 0, 'orders': 0}
+    with Pool(args.workers) as pool:
+        for kind, count in pool.imap_unordered(_insert_chunk, tasks):
+            done[kind] += count
+            print(f"\r{done['products']} products, {done['users']} users, {done['orders']} orders", end='', flush=True)
+
+    print(f'\nGenerated run {args.run_id} in {time.time() - started:.1f}s '
+          f'({args.categories} categories, {len(images)} images)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Gunicorn settings for production.
+
+    gunicorn -c gunicorn_config.py app:app
+
+Pick a worker model with GUNICORN_PROFILE (sync, gthread or gevent) and
+override the counts with GUNICORN_WORKERS / GUNICORN_THREADS /
+GUNICORN_WORKER_CONNECTIONS. Use bench_workers.py to measure which profile
+and counts suit the box before changing the defaults.
+"""
+import multiprocessing
+import os
+
+cpus = multiprocessing.cpu_count()
+
+PROFILES = {
+    # One request per process; simplest and most isolated, but every
+    # Mongo or Stripe wait blocks a whole worker.
+    'sync': {
+        'worker_class': 'sync',
+        'workers': cpus * 2 + 1,
+        'threads': 1,
+    },
+    # A few threads per process so requests waiting on Mongo/Stripe don't
+    # hold up the rest; each process still has a single Mongo pool.
+    'gthread': {
+        'worker_class': 'gthread',
+        'workers': cpus + 1,
+        'threads': 4,
+    },
+    # Cooperative greenlets for I/O-heavy traffic. Needs `pip install gevent`.
+    'gevent': {
+        'worker_class': 'gevent',
+        'workers': cpus + 1,
+        'worker_connections': 200,
+    },
+}
+
+profile = os.getenv('GUNICORN_PROFILE', 'gthread')
+if profile not in PROFILES:
+    raise RuntimeError(f"Unknown GUNICORN_PROFILE {profile!r}; expected one of {', '.join(PROFILES)}")
+settings = PROFILES[profile]
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+worker_class = settings['worker_class']
+workers = int(os.getenv('GUNICORN_WORKERS', settings['workers']))
+threads = int(os.getenv('GUNICORN_THREADS', settings.get('threads', 1)))
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', settings.get('worker_connections', 1000)))
+
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('GUNICORN_KEEPALIVE', 5))
+# Recycle workers now and then so slow leaks can't build up
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 2000))
+max_requests_jitter = int(os.getenv('GUNICORN_MAX_REQUESTS_JITTER', 200))
+
+# create_app() makes no connections, so loading the app once in the master
+# is safe and makes forks cheap. gevent has to patch the stdlib before the
+# app is imported, so it loads the app in each worker instead.
+preload_app = worker_class != 'gevent'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+errorlog = os.getenv('GUNICORN_ERROR_LOG', '-')
+loglevel = os.getenv('GUNICORN_LOG_LEVEL', 'info')
+
+
+def _open_mongo_pool(worker):
+    import database
+    try:
+        database.get_client().admin.command('ping')
+        worker.log.info(f'Worker {worker.pid}: MongoDB pool ready')
+    except Exception as e:
+        # Don't kill the worker; requests will retry the connection.
+        worker.log.warning(f'Worker {worker.pid}: MongoDB not reachable yet: {e}')
+
+    # Start the health probe now so /readyz has an answer by the first check
+    import health
+    health.monitor.ensure_thread()
+
+    # Build the search index in the background before searches arrive
+    import search_index
+    search_index.index.ensure_built()
+
+    # Keep the trending ranking current; one worker at a time does the work
+    import trending
+    trending.refresher.ensure_thread()
+
+
+def on_starting(server):
+    # Worker metrics files from a previous run would add to this run's counters
+    import metrics
+    metrics.settings['METRICS_DIR'] = os.getenv('METRICS_DIR', metrics.settings['METRICS_DIR'])
+    metrics.clear()
+
+
+def post_fork(server, worker):
+    # Open this worker's own Mongo pool right after the fork so the first
+    # request doesn't pay for server discovery and the TLS handshake.
+    if worker_class != 'gevent':
+        _open_mongo_pool(worker)
+
+
+def post_worker_init(worker):
+    # gevent patches sockets and threads after post_fork, so the pool is
+    # opened here instead.
+    if worker_class == 'gevent':
+        _open_mongo_pool(worker)
@@ -0,0 +1,183 @@
+"""Liveness and readiness probes served from a cached health state.
+
+A background thread in each worker refreshes the state every
+HEALTH_INTERVAL_S: MongoDB ping latency, connection pool saturation (from
+database.pool_stats()) and, with HEALTH_STRIPE_CHECK on, whether the Stripe
+API answers at all, checked only every HEALTH_STRIPE_INTERVAL_S. The WSGI
+middleware answers the probe paths from that state before Flask sees the
+request, so a load balancer check costs no database round trip, session or
+template work:
+
+    /healthz  200 while the worker is serving and the probe thread is alive
+    /readyz   200 when MongoDB answers pings (one miss is tolerated) and
+              the pool is not saturated, 503 otherwise (Stripe problems are reported but
+              don't take the worker out of rotation)
+
+Liveness never depends on MongoDB, so a slow Atlas makes workers unready
+instead of getting them restarted.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import pymongo
+
+import database
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'HEALTH_INTERVAL_S': 5.0,
+    'HEALTH_MONGO_TIMEOUT_MS': 2000,
+    # Not ready after this many failed pings in a row
+    'HEALTH_MONGO_FAILURES': 2,
+    # Not ready while this fraction of the pool is checked out
+    'HEALTH_MAX_POOL_SATURATION': 0.95,
+    # Off by default: every worker would call api.stripe.com
+    'HEALTH_STRIPE_CHECK': False,
+    'HEALTH_STRIPE_INTERVAL_S': 300.0,
+    'HEALTH_STRIPE_TIMEOUT_MS': 2000,
+    # /healthz fails if the probe thread hasn't reported for this long
+    'HEALTH_STALE_S': 60.0,
+    'STRIPE_API_BASE': None,
+}
+
+PATHS = ('/healthz', '/readyz')
+
+
+def check_mongo():
+    started = time.perf_counter()
+    with pymongo.timeout(settings['HEALTH_MONGO_TIMEOUT_MS'] / 1000):
+        database.get_client().admin.command('ping')
+    return (time.perf_counter() - started) * 1000
+
+
+def check_stripe():
+    # Any HTTP answer (a 401 without a key, say) means the API is reachable
+    base = settings['STRIPE_API_BASE'] or 'https://api.stripe.com'
+    started = time.perf_counter()
+    try:
+        urllib.request.urlopen(base.rstrip('/') + '/v1/', timeout=settings['HEALTH_STRIPE_TIMEOUT_MS'] / 1000).close()
+    except urllib.error.HTTPError:
+        pass
+    return (time.perf_counter() - started) * 1000
+
+
+class HealthMonitor:
+    """Per-process health state refreshed by a background thread."""
+
+    def __init__(self):
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.mongo_failures = 0
+        self.mongo_seen = False
+        self.stripe = None
+        self.stripe_checked_at = 0.0
+        # Replaced wholesale on every refresh, so readers never need a lock
+        self.state = {'status': 'starting', 'checked_at': None}
+
+    def ensure_thread(self):
+        # Threads don't survive fork, so start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self.mongo_failures = 0
+                self.mongo_seen = False
+                self.stripe = None
+                self.stripe_checked_at = 0.0
+                self.state = {'status': 'starting', 'checked_at': None}
+                threading.Thread(target=self._run, name='health-probe', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception:
+                logger.exception('Health probe failed')
+            time.sleep(settings['HEALTH_INTERVAL_S'])
+
+    def refresh(self):
+        state = {'pid': os.getpid(), 'checked_at': time.time()}
+        reasons = []
+
+        try:
+            state['mongo'] = {'ok': True, 'ping_ms': round(check_mongo(), 2)}
+            self.mongo_failures = 0
+            self.mongo_seen = True
+        except Exception as e:
+            self.mongo_failures += 1
+            state['mongo'] = {'ok': False, 'error': str(e)[:200], 'consecutive_failures': self.mongo_failures}
+            # Tolerate a blip once connected, but never start out ready
+            if not self.mongo_seen or self.mongo_failures >= settings['HEALTH_MONGO_FAILURES']:
+                reasons.append('mongo unreachable')
+
+        pool = database.pool_stats()
+        if pool is not None:
+            state['pool'] = pool
+            if pool['saturation'] >= settings['HEALTH_MAX_POOL_SATURATION']:
+                reasons.append('connection pool saturated')
+
+        if settings['HEALTH_STRIPE_CHECK']:
+            # Far less often than the Mongo ping; the last answer is reused in between
+            if time.time() - self.stripe_checked_at >= settings['HEALTH_STRIPE_INTERVAL_S']:
+                self.stripe_checked_at = time.time()
+                try:
+                    self.stripe = {'ok': True, 'latency_ms': round(check_stripe(), 2),
+                                   'checked_at': self.stripe_checked_at}
+                except Exception as e:
+                    self.stripe = {'ok': False, 'error': str(e)[:200], 'checked_at': self.stripe_checked_at}
+            state['stripe'] = self.stripe
+
+        state['status'] = 'not ready' if reasons else 'ready'
+        state['reasons'] = reasons
+        self.state = state
+
+    def liveness(self):
+        state = self.state
+        checked_at = state.get('checked_at')
+        # Before the first refresh the thread has only just been started
+        if checked_at is not None and time.time() - checked_at > settings['HEALTH_STALE_S']:
+            return 503, {'status': 'stale', 'checked_at': checked_at}
+        return 200, {'status': 'ok', 'pid': os.getpid(), 'checked_at': checked_at}
+
+    def readiness(self):
+        state = self.state
+        return (200 if state['status'] == 'ready' else 503), state
+
+
+monitor = HealthMonitor()
+
+
+class HealthMiddleware:
+    """Answers /healthz and /readyz without entering the Flask app."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        monitor.ensure_thread()
+        path = environ.get('PATH_INFO', '')
+        if path not in PATHS:
+            return self.wsgi_app(environ, start_response)
+
+        status, payload = monitor.liveness() if path == '/healthz' else monitor.readiness()
+        body = json.dumps(payload).encode()
+        start_response('200 OK' if status == 200 else '503 Service Unavailable', [
+            ('Content-Type', 'application/json'),
+            ('Content-Length', str(len(body))),
+            ('Cache-Control', 'no-store'),
+        ])
+        return [body]
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    app.wsgi_app = HealthMiddleware(app.wsgi_app)
@@ -1,4 +1,5 @@
-from app import app, db
+from app import create_app
+from database import db
 from bson import ObjectId
 from datetime import datetime
 import os
@@ -8,6 +9,28 @@ def init_db():
     db.orders.create_index([("user_id", 1)])
     db.orders.create_index([("status", 1)])
     db.orders.create_index([("created_at", -1)])
+
+    # Category pages look categories up by slug (see migrate_category_slugs.py)
+    db.categories.create_index("slug", unique=True, partialFilterExpression={"slug": {"$type": "string"}})
+
+    # Weighted text index for product search (see search.py)
+    import search
+    search.create_index()
+    # Products reached through ids they had before migrate_product_ids.py
+    import product_ids
+    product_ids.create_index()
+
+    # Most asked searches first (see query_stats.py)
+    db.search_queries.create_index([("count", -1)])
+    # Trending strip on /main (see trending.py)
+    import trending
+    trending.create_index()
+
+    # Keyset pagination indexes, one per sort order (see pagination.py),
+    # on their own and within a category
+    for field in ("name", "price", "created_at"):
+        db.products.create_index([(field, 1), ("_id", 1)])
+        db.products.create_index([("category", 1), (field, 1), ("_id", 1)])
     
     # Create admin user if it doesn't exist
     admin_email = os.getenv('ADMIN_EMAIL', 'admin@example.com')
@@ -38,5 +61,6 @@ def init_db():
     print("Database initialization complete!")
 
 if __name__ == "__main__":
+    app = create_app()
     with app.app_context():
         init_db()
@@ -0,0 +1,114 @@
+"""Small threaded HTTP load generator used by the benchmark scripts."""
+import threading
+import time
+
+import requests
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100.0 * len(sorted_values) + 0.5)) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+def summarize(latencies, errors, elapsed):
+    """Throughput and latency percentiles (in ms) for one route."""
+    latencies = sorted(latencies)
+    count = len(latencies)
+    return {
+        'requests': count,
+        'errors': errors,
+        'throughput_rps': round(count / elapsed, 2) if elapsed else 0.0,
+        'mean_ms': round(sum(latencies) / count * 1000, 2) if count else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if count else 0.0,
+    }
+
+
+class Recorder:
+    """Thread-safe latency samples grouped by route label."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, route, seconds, ok):
+        with self._lock:
+            self.samples.setdefault(route, []).append(seconds)
+            if not ok:
+                self.errors[route] = self.errors.get(route, 0) + 1
+
+    def timed(self, route, session, method, url, **kwargs):
+        """Send one request, record its latency and return the response."""
+        kwargs.setdefault('allow_redirects', False)
+        kwargs.setdefault('timeout', 30)
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            self.record(route, time.perf_counter() - started, False)
+            return None
+        self.record(route, time.perf_counter() - started, response.status_code < 400)
+        return response
+
+    def report(self, elapsed):
+        with self._lock:
+            return {
+                route: summarize(latencies, self.errors.get(route, 0), elapsed)
+                for route, latencies in sorted(self.samples.items())
+            }
+
+
+def run_workers(concurrency, duration, make_worker):
+    """Run ``concurrency`` threads for ``duration`` seconds.
+
+    ``make_worker(index)`` is called once per thread (for login and other
+    setup) and returns a function that performs one iteration of the flow.
+    Returns the measured wall-clock time.
+    """
+    ready = threading.Barrier(concurrency + 1)
+    go = threading.Event()
+    state = {'deadline': None}
+
+    def loop(index):
+        try:
+            step = make_worker(index)
+        except Exception:
+            # Unblock the main thread instead of leaving it at the barrier
+            ready.abort()
+            raise
+        ready.wait()
+        go.wait()
+        while time.perf_counter() < state['deadline']:
+            step()
+
+    threads = [threading.Thread(target=loop, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    try:
+        ready.wait()
+    except threading.BrokenBarrierError:
+        raise RuntimeError('A load worker failed during setup') from None
+    started = time.perf_counter()
+    state['deadline'] = started + duration
+    go.set()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - started
+
+
+def wait_for_server(base_url, timeout=30):
+    """Poll until the server answers HTTP, or raise after ``timeout`` seconds."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            requests.get(base_url + '/', timeout=2, allow_redirects=False)
+            return
+        except requests.RequestException:
+            time.sleep(0.25)
+    raise RuntimeError(f'Server at {base_url} did not come up within {timeout}s')
@@ -0,0 +1,205 @@
+"""End-to-end load test against a local mongod and the Stripe stand-in.
+
+Each virtual user signs up and then repeats the shopping flow:
+
+    browse  GET /main, GET /category/<name>, GET /search?q=
+    cart    POST /add_to_cart/<id>, GET /cart, POST /create-checkout-session
+    pay     GET /success?session_id=
+    orders  GET /user/orders
+
+The script starts fake_stripe.py and the app under gunicorn, seeds the
+database if it is empty, runs the flow and writes p50/p95/p99 latency and
+throughput per route to a JSON report:
+
+    python loadtest.py --duration 60 --concurrency 32 --output report.json
+
+The Stripe stand-in takes the same --latency-ms, --jitter-ms, --error-rate
+and --error-statuses options as fake_stripe.py, and they are recorded in the
+report, so runs with slow or failing Stripe calls can be compared.
+
+It refuses to run against anything but a local MongoDB unless
+--allow-remote is given.
+"""
+import argparse
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import uuid
+from urllib.parse import urlsplit
+
+import requests
+from pymongo import MongoClient
+
+import fake_stripe
+from bench_workers import stop_server
+from filters import slugify
+from loadgen import Recorder, run_workers, wait_for_server
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+LOCAL_HOSTS = ('localhost', '127.0.0.1', '::1')
+
+
+def seed(db, products=200, categories=8):
+    """Insert a small catalog when the database has no products."""
+    if db.products.estimated_document_count():
+        return False
+    names = [f'Category {i}' for i in range(categories)]
+    db.categories.insert_many([{'name': name, 'slug': slugify(name)} for name in names])
+    db.products.insert_many([{
+        '_id': str(uuid.uuid4()),
+        'name': f'Snack {i} {random.choice(["Bhujia", "Chakli", "Ladoo", "Mathri", "Namkeen"])}',
+        'price': round(random.uniform(1, 40), 2),
+        'stock': random.randint(0, 500),
+        'description': 'Crunchy, spicy and freshly packed.',
+        'main_image': {'id': 'placeholder', 'content_type': 'image/png'},
+        'additional_images': [],
+        'video': None,
+        'category': random.choice(names),
+    } for i in range(products)])
+    return True
+
+
+def load_catalog(db):
+    products = [str(p['_id']) for p in db.products.find({'price': {'$gt': 0}}, {'_id': 1}).limit(1000)]
+    categories = [c['name'] for c in db.categories.find({}, {'name': 1})]
+    words = set()
+    for product in db.products.find({}, {'name': 1}).limit(1000):
+        words.update(w for w in str(product.get('name', '')).split() if len(w) > 3)
+    if not products or not categories:
+        raise RuntimeError('The database needs at least one priced product and one category')
+    return {'products': products, 'categories': categories, 'words': sorted(words) or ['snack']}
+
+
+def start_app(port, mongo_uri, stripe_base, profile):
+    env = dict(os.environ)
+    env.update({
+        'MONGO_URI': mongo_uri,
+        'MONGO_TLS': 'false',
+        'STRIPE_SECRET_KEY': 'sk_test_loadtest',
+        'STRIPE_PUBLIC_KEY': 'pk_test_loadtest',
+        'STRIPE_API_BASE': stripe_base,
+        'GUNICORN_PROFILE': profile,
+        'GUNICORN_BIND': f'127.0.0.1:{port}',
+        'GUNICORN_ACCESS_LOG': '/dev/null',
+    })
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn_config.py', 'app:app'],
+        cwd=HERE,
+        env=env,
+    )
+
+
+def make_flow(base_url, recorder, catalog):
+    def make_worker(index):
+        session = requests.Session()
+        session.post(base_url + '/user/signup', data={
+            'name': f'Load User {index}',
+            'email': f'load-{uuid.uuid4().hex}@example.com',
+            'password': 'load-password',
+        }, allow_redirects=False, timeout=30)
+        rng = random.Random(index)
+
+        def step():
+            # Browse
+            recorder.timed('GET /main', session, 'GET', base_url + '/main')
+            category = slugify(rng.choice(catalog['categories']))
+            recorder.timed('GET /category/<name>', session, 'GET', f'{base_url}/category/{category}')
+            recorder.timed('GET /search', session, 'GET', base_url + '/search',
+                           params={'q': rng.choice(catalog['words'])})
+
+            # Cart and checkout
+            for product_id in rng.sample(catalog['products'], min(3, len(catalog['products']))):
+                recorder.timed('POST /add_to_cart/<id>', session, 'POST', f'{base_url}/add_to_cart/{product_id}')
+            recorder.timed('GET /cart', session, 'GET', base_url + '/cart')
+            response = recorder.timed('POST /create-checkout-session', session, 'POST',
+                                      base_url + '/create-checkout-session')
+            if response is None or response.status_code != 200:
+                return
+            session_id = response.json().get('id')
+
+            # Payment confirmation and order history
+            recorder.timed('GET /success', session, 'GET', base_url + '/success',
+                           params={'session_id': session_id})
+            recorder.timed('GET /user/orders', session, 'GET', base_url + '/user/orders')
+
+        return step
+
+    return make_worker
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default=os.getenv('LOADTEST_MONGO_URI', 'mongodb://localhost:27017/shimplyshop_loadtest'))
+    parser.add_argument('--allow-remote', action='store_true', help='allow a non-local MongoDB')
+    parser.add_argument('--base-url', help='test an already running app instead of starting one')
+    parser.add_argument('--port', type=int, default=8200)
+    parser.add_argument('--stripe-port', type=int, default=12111)
+    parser.add_argument('--profile', default='gthread', help='gunicorn profile (see gunicorn_config.py)')
+    parser.add_argument('--duration', type=float, default=60)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--no-seed', action='store_true', help="don't seed an empty database")
+    parser.add_argument('--output', default='loadtest-report.json')
+    fake_stripe.add_fault_arguments(parser)
+    args = parser.parse_args()
+
+    if urlsplit(args.mongo_uri).hostname not in LOCAL_HOSTS and not args.allow_remote:
+        parser.error(f'{args.mongo_uri} is not a local MongoDB; pass --allow-remote to use it anyway')
+
+    client = MongoClient(args.mongo_uri)
+    db = client.get_database()
+    if not args.no_seed and seed(db):
+        print('Seeded an empty database with a small catalog')
+    catalog = load_catalog(db)
+
+    faults = fake_stripe.faults_from_args(args)
+    stripe_server = fake_stripe.start(port=args.stripe_port, faults=faults)
+    app_process = None
+    base_url = args.base_url
+    if not base_url:
+        base_url = f'http://127.0.0.1:{args.port}'
+        app_process = start_app(args.port, args.mongo_uri, f'http://127.0.0.1:{args.stripe_port}', args.profile)
+
+    try:
+        wait_for_server(base_url)
+        print(f'Running {args.concurrency} users against {base_url} for {args.duration:g}s...')
+        recorder = Recorder()
+        elapsed = run_workers(args.concurrency, args.duration, make_flow(base_url, recorder, catalog))
+    finally:
+        if app_process is not None:
+            stop_server(app_process)
+        stripe_server.shutdown()
+
+    routes = recorder.report(elapsed)
+    report = {
+        'started_at': datetime.datetime.utcnow().isoformat() + 'Z',
+        'git_revision': git_revision(),
+        'profile': args.profile,
+        'concurrency': args.concurrency,
+        'duration_s': round(elapsed, 2),
+        'stripe': faults.as_dict(),
+        'catalog': {'products': len(catalog['products']), 'categories': len(catalog['categories'])},
+        'routes': routes,
+        'total_requests': sum(r['requests'] for r in routes.values()),
+        'total_errors': sum(r['errors'] for r in routes.values()),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    for route, stats in routes.items():
+        print(f"{route:<32} {stats['throughput_rps']:>8} rps  p50 {stats['p50_ms']:>8}  "
+              f"p95 {stats['p95_ms']:>8}  p99 {stats['p99_ms']:>8}  errors {stats['errors']}")
+    print(f'Report written to {args.output}')
+
+
+if __name__ == '__main__':
+    main()
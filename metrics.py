@@ -0,0 +1,334 @@
+"""Per-endpoint request metrics in Prometheus text format at /metrics.
+
+Each worker records, per endpoint and method:
+
+- a latency histogram with log-spaced buckets (two per doubling, 0.25ms to
+  ~90s), the fixed-bucket form of an HDR histogram, so histograms from
+  different workers merge by adding counts
+- time spent in MongoDB (from mongo_monitor) and in render_template, to split
+  slow requests into DB time and render time
+- requests by status code, and requests in flight
+
+Workers share nothing in memory, so every process writes its counters to
+METRICS_DIR/<pid>.json every METRICS_FLUSH_S seconds and /metrics adds up the
+files of all workers. Files of workers that have exited are folded into
+archive.json so their counts survive worker recycling. gunicorn_config.py
+empties the directory when the master starts.
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, before_render_template, g, request, template_rendered
+
+settings = {
+    'METRICS_DIR': '/tmp/shimplyshop-metrics',
+    'METRICS_FLUSH_S': 5.0,
+}
+
+PREFIX = 'shimplyshop'
+
+# Bucket upper bounds in seconds: 2 ** (k / 2) * 0.25ms
+BOUNDS = [round(0.00025 * 2 ** (k / 2), 6) for k in range(37)]
+
+_ARCHIVE = 'archive.json'
+
+
+def bucket_index(seconds):
+    for i, bound in enumerate(BOUNDS):
+        if seconds <= bound:
+            return i
+    return len(BOUNDS)
+
+
+class Series:
+    """Counters for one (endpoint, method)."""
+
+    def __init__(self):
+        self.buckets = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.seconds = 0.0
+        self.db_seconds = 0.0
+        self.db_queries = 0
+        self.render_seconds = 0.0
+
+    def as_dict(self):
+        return dict(vars(self))
+
+    def add(self, data):
+        self.buckets = [a + b for a, b in zip(self.buckets, data['buckets'])]
+        for key in ('count', 'seconds', 'db_seconds', 'db_queries', 'render_seconds'):
+            setattr(self, key, getattr(self, key) + data[key])
+
+
+class Registry:
+    """This process's metrics; ``snapshot()`` is what gets written to disk."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.series = {}
+        self.statuses = {}
+        self.in_flight = {}
+
+    def start(self, endpoint):
+        with self.lock:
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 0) + 1
+
+    def finish(self, endpoint, method, status, seconds, db_seconds, db_queries, render_seconds):
+        with self.lock:
+            self.in_flight[endpoint] = self.in_flight.get(endpoint, 1) - 1
+            series = self.series.get((endpoint, method))
+            if series is None:
+                series = self.series[(endpoint, method)] = Series()
+            series.buckets[bucket_index(seconds)] += 1
+            series.count += 1
+            series.seconds += seconds
+            series.db_seconds += db_seconds
+            series.db_queries += db_queries
+            series.render_seconds += render_seconds
+            key = (endpoint, method, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'pid': os.getpid(),
+                'series': [[e, m, s.as_dict()] for (e, m), s in self.series.items()],
+                'statuses': [[e, m, s, n] for (e, m, s), n in self.statuses.items()],
+                'in_flight': dict(self.in_flight),
+            }
+
+
+registry = Registry()
+
+
+def merge(snapshots):
+    """Add up snapshots from several processes into one Registry."""
+    total = Registry()
+    for snap in snapshots:
+        for endpoint, method, data in snap.get('series', []):
+            total.series.setdefault((endpoint, method), Series()).add(data)
+        for endpoint, method, status, n in snap.get('statuses', []):
+            key = (endpoint, method, status)
+            total.statuses[key] = total.statuses.get(key, 0) + n
+        for endpoint, n in snap.get('in_flight', {}).items():
+            total.in_flight[endpoint] = total.in_flight.get(endpoint, 0) + n
+    return total
+
+
+# File store ------------------------------------------------------------------
+
+def _path(name):
+    return os.path.join(settings['METRICS_DIR'], name)
+
+
+def _read(name):
+    try:
+        with open(_path(name)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _write(name, data):
+    tmp = _path(f'.{name}.{os.getpid()}.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp, _path(name))
+
+
+@contextmanager
+def _dir_lock():
+    with open(_path('.lock'), 'w') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def flush():
+    os.makedirs(settings['METRICS_DIR'], exist_ok=True)
+    _write(f'{os.getpid()}.json', registry.snapshot())
+
+
+def collect():
+    """Flush this worker, fold exited workers into the archive and merge all."""
+    flush()
+    with _dir_lock():
+        archive = _read(_ARCHIVE) or {}
+        snapshots = []
+        dead = []
+        for name in os.listdir(settings['METRICS_DIR']):
+            if not name.endswith('.json') or name == _ARCHIVE:
+                continue
+            snap = _read(name)
+            if snap is None:
+                continue
+            if _alive(snap['pid']):
+                snapshots.append(snap)
+            else:
+                dead.append((name, snap))
+        if dead:
+            folded = merge([archive] + [snap for _, snap in dead])
+            archive = folded.snapshot()
+            archive['in_flight'] = {}
+            _write(_ARCHIVE, archive)
+            for name, _ in dead:
+                os.remove(_path(name))
+    return merge([archive] + snapshots)
+
+
+def clear():
+    """Remove every worker file; call once when the server starts."""
+    directory = settings['METRICS_DIR']
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(('.json', '.tmp')):
+            os.remove(os.path.join(directory, name))
+
+
+class Flusher:
+    """Background thread that writes this worker's counters to disk."""
+
+    def __init__(self):
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def ensure_thread(self):
+        # Threads don't survive fork, so start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='metrics-flush', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(settings['METRICS_FLUSH_S'])
+            try:
+                flush()
+            except OSError:
+                pass
+
+
+flusher = Flusher()
+
+
+# Exposition -------------------------------------------------------------------
+
+def _labels(**labels):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels.items()) + '}'
+
+
+def render(total):
+    name = f'{PREFIX}_request_duration_seconds'
+    lines = [
+        f'# HELP {name} Request latency by endpoint.',
+        f'# TYPE {name} histogram',
+    ]
+    for (endpoint, method), series in sorted(total.series.items()):
+        cumulative = 0
+        for bound, n in zip(BOUNDS + ['+Inf'], series.buckets):
+            cumulative += n
+            lines.append(f'{name}_bucket{_labels(endpoint=endpoint, method=method, le=bound)} {cumulative}')
+        lines.append(f'{name}_sum{_labels(endpoint=endpoint, method=method)} {series.seconds:.6f}')
+        lines.append(f'{name}_count{_labels(endpoint=endpoint, method=method)} {series.count}')
+
+    for metric, attr, help_text in (
+        ('request_db_seconds_total', 'db_seconds', 'Time spent in MongoDB commands.'),
+        ('request_db_queries_total', 'db_queries', 'MongoDB commands sent.'),
+        ('request_render_seconds_total', 'render_seconds', 'Time spent rendering templates.'),
+    ):
+        lines.append(f'# HELP {PREFIX}_{metric} {help_text}')
+        lines.append(f'# TYPE {PREFIX}_{metric} counter')
+        for (endpoint, method), series in sorted(total.series.items()):
+            value = getattr(series, attr)
+            value = f'{value:.6f}' if isinstance(value, float) else value
+            lines.append(f'{PREFIX}_{metric}{_labels(endpoint=endpoint, method=method)} {value}')
+
+    lines.append(f'# HELP {PREFIX}_requests_total Requests by status code.')
+    lines.append(f'# TYPE {PREFIX}_requests_total counter')
+    for (endpoint, method, status), n in sorted(total.statuses.items()):
+        lines.append(f'{PREFIX}_requests_total{_labels(endpoint=endpoint, method=method, status=status)} {n}')
+
+    lines.append(f'# HELP {PREFIX}_requests_in_flight Requests being handled right now.')
+    lines.append(f'# TYPE {PREFIX}_requests_in_flight gauge')
+    for endpoint, n in sorted(total.in_flight.items()):
+        lines.append(f'{PREFIX}_requests_in_flight{_labels(endpoint=endpoint)} {n}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view():
+    return Response(render(collect()), mimetype='text/plain; version=0.0.4')
+
+
+# Request hooks ----------------------------------------------------------------
+
+def _endpoint():
+    # Unmatched URLs share one label so 404 scans can't blow up cardinality
+    return request.endpoint or 'unmatched'
+
+
+def _start_request():
+    flusher.ensure_thread()
+    g.metrics_started = time.perf_counter()
+    g.metrics_render_seconds = 0.0
+    registry.start(_endpoint())
+
+
+def _record_status(response):
+    g.metrics_status = response.status_code
+    return response
+
+
+def _finish_request(exc):
+    started = g.pop('metrics_started', None)
+    if started is None:
+        return
+    stats = g.get('mongo_stats')
+    registry.finish(
+        _endpoint(),
+        request.method,
+        500 if exc is not None else g.get('metrics_status', 500),
+        time.perf_counter() - started,
+        stats.duration_micros / 1e6 if stats is not None else 0.0,
+        stats.count if stats is not None else 0,
+        g.get('metrics_render_seconds', 0.0),
+    )
+
+
+def _render_started(sender, template, context, **extra):
+    g.metrics_render_started = time.perf_counter()
+
+
+def _render_finished(sender, template, context, **extra):
+    started = g.pop('metrics_render_started', None)
+    if started is not None:
+        g.metrics_render_seconds = g.get('metrics_render_seconds', 0.0) + time.perf_counter() - started
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    app.before_request(_start_request)
+    app.after_request(_record_status)
+    app.teardown_request(_finish_request)
+    before_render_template.connect(_render_started, app)
+    template_rendered.connect(_render_finished, app)
+    app.add_url_rule('/metrics', 'metrics', metrics_view)
@@ -0,0 +1,60 @@
+"""Store a URL slug on every category and index it.
+
+category_page() looks categories up by their stored ``slug``. Run this once
+after deploying to add slugs to categories created before that:
+
+    python migrate_category_slugs.py [--dry-run]
+
+Two names that map to the same slug ("Dry Fruits" and "dry-fruits") can't
+both keep it; the later one gets a numbered slug and is reported, so rename
+it or fix its links. Safe to run again.
+"""
+import argparse
+
+import catalog_cache
+from app import create_app
+from database import db
+from filters import slugify
+
+
+def migrate(dry_run=False):
+    taken = {c['slug'] for c in db.categories.find({'slug': {'$type': 'string'}}, {'slug': 1})}
+    updated = 0
+    for category in db.categories.find({'slug': {'$not': {'$type': 'string'}}}).sort('_id', 1):
+        base = slugify(category['name'])
+        slug, n = base, 2
+        while slug in taken:
+            slug, n = f'{base}-{n}', n + 1
+        if slug != base:
+            print(f"{category['name']!r}: /category/{base} is taken, using /category/{slug}")
+        taken.add(slug)
+        if not dry_run:
+            db.categories.update_one({'_id': category['_id']}, {'$set': {'slug': slug}})
+        updated += 1
+    return updated
+
+
+def create_indexes():
+    # Partial, so categories still waiting for a slug don't collide on null
+    db.categories.create_index('slug', unique=True, partialFilterExpression={'slug': {'$type': 'string'}})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        updated = migrate(args.dry_run)
+        if args.dry_run:
+            print(f'{updated} categories need a slug')
+            return
+        create_indexes()
+        if updated:
+            catalog_cache.invalidate(product_ids=())
+        print(f'Added slugs to {updated} categories')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Give every product a UUID string ``_id`` and remember its old one.
+
+Products created before add_product used UUIDs have ObjectId or other string
+ids, so every lookup had to try more than one form. This moves each such
+product to a new id (a UUID derived from the old one, so reruns pick the
+same id), keeps the old id in ``legacy_ids`` so old product links, carts and
+bookmarks still resolve (see product_ids.py), and points order items at the
+new ids:
+
+    python migrate_product_ids.py [--dry-run] [--skip-orders]
+
+Safe to run again, also after an interrupted run. Products are copied before
+the old document is deleted, so a product is never missing; a copy left by
+an interrupted run is reused.
+"""
+import argparse
+import uuid
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+import catalog_cache
+import product_ids
+from app import create_app
+from database import db
+
+# Fixed, so an old id always maps to the same new one
+NAMESPACE = uuid.UUID('6f1c5a2e-4d0b-4b8e-9a51-3c7f2e8d9b40')
+BATCH = 1000
+
+
+def is_normalized(product_id):
+    if not isinstance(product_id, str):
+        return False
+    try:
+        return str(uuid.UUID(product_id)) == product_id
+    except ValueError:
+        return False
+
+
+def new_id(old_id):
+    return str(uuid.uuid5(NAMESPACE, str(old_id)))
+
+
+def _move(batch):
+    copies = []
+    for product in batch:
+        legacy = set(product.get('legacy_ids') or []) | {str(product['_id'])}
+        copies.append(dict(product, _id=new_id(product['_id']), legacy_ids=sorted(legacy)))
+    try:
+        db.products.insert_many(copies, ordered=False)
+    except BulkWriteError as e:
+        # Copies made by an earlier, interrupted run are already there
+        if any(error['code'] != 11000 for error in e.details['writeErrors']):
+            raise
+    db.products.delete_many({'_id': {'$in': [product['_id'] for product in batch]}})
+
+
+def migrate_products(dry_run=False):
+    moved = 0
+    batch = []
+    for product in db.products.find():
+        if is_normalized(product['_id']):
+            continue
+        print(f"{product['_id']!r} -> {new_id(product['_id'])} ({product.get('name')})")
+        moved += 1
+        if dry_run:
+            continue
+        batch.append(product)
+        if len(batch) == BATCH:
+            _move(batch)
+            batch = []
+    if batch:
+        _move(batch)
+    return moved
+
+
+def legacy_map():
+    """{old id: current id} for every migrated product."""
+    mapping = {}
+    for product in db.products.find({'legacy_ids': {'$exists': True}}, {'legacy_ids': 1}):
+        for old in product['legacy_ids']:
+            mapping[old] = str(product['_id'])
+    return mapping
+
+
+def migrate_orders(mapping, dry_run=False):
+    """Point order items at current product ids, in one pass over the orders."""
+    if not mapping:
+        return 0
+    updates = []
+    changed = 0
+    for order in db.orders.find({'items.product_id': {'$exists': True}}, {'items': 1}):
+        items = order.get('items') or []
+        new_items = [dict(item, product_id=mapping[item['product_id']])
+                     if isinstance(item, dict) and item.get('product_id') in mapping else item
+                     for item in items]
+        if new_items == items:
+            continue
+        changed += 1
+        if dry_run:
+            continue
+        updates.append(UpdateOne({'_id': order['_id']}, {'$set': {'items': new_items}}))
+        if len(updates) == BATCH:
+            db.orders.bulk_write(updates, ordered=False)
+            updates = []
+    if updates:
+        db.orders.bulk_write(updates, ordered=False)
+    return changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dry-run', action='store_true', help='report what would change without writing')
+    parser.add_argument('--skip-orders', action='store_true', help="don't rewrite product ids in orders")
+    args = parser.parse_args()
+
+    app = create_app()
+    with app.app_context():
+        product_ids.create_index()
+        moved = migrate_products(args.dry_run)
+        if moved and not args.dry_run:
+            catalog_cache.invalidate()
+        print(f"{'Would move' if args.dry_run else 'Moved'} {moved} products to UUID ids")
+        if args.skip_orders:
+            return
+        mapping = legacy_map()
+        if args.dry_run:
+            # Nothing was moved yet, so map what would be
+            mapping.update({str(p['_id']): new_id(p['_id']) for p in db.products.find({}, {'_id': 1})
+                            if not is_normalized(p['_id'])})
+        changed = migrate_orders(mapping, args.dry_run)
+        print(f"{'Would update' if args.dry_run else 'Updated'} {changed} orders")
+
+
+if __name__ == '__main__':
+    main()
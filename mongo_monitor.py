@@ -0,0 +1,185 @@
+"""Per-request MongoDB command accounting and N+1 query detection.
+
+Every command a request sends is counted and timed through a pymongo
+CommandListener. Commands are grouped by "shape" (command, collection and the
+filter with its values masked), so a handler that runs
+``find_one({'_id': ...})`` once per cart item shows up as the same shape
+repeated N times. Requests that repeat a shape more than
+MONGO_N_PLUS_ONE_THRESHOLD times are logged, and the totals are sent back in a
+``Server-Timing`` header and summarised per route at /debug/queries.
+"""
+import logging
+import threading
+from collections import Counter
+
+from flask import g, has_request_context, request
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'MONGO_N_PLUS_ONE_THRESHOLD': 5,
+    # Raise NPlusOneError instead of only logging (for tests and local runs)
+    'MONGO_N_PLUS_ONE_RAISE': False,
+}
+
+# Filter-like argument for each command we know how to shape
+_SPEC_FIELDS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'aggregate': 'pipeline',
+    'update': 'updates',
+    'delete': 'deletes',
+}
+
+
+class NPlusOneError(Exception):
+    pass
+
+
+def _mask(value):
+    """Replace literal values with '?' but keep keys and operators."""
+    if isinstance(value, dict):
+        return '{' + ', '.join(f'{k}: {_mask(v)}' for k, v in sorted(value.items())) + '}'
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, dict) for v in value):
+            return '[' + ', '.join(_mask(v) for v in value) + ']'
+        return '[?]'
+    return '?'
+
+
+def command_shape(command_name, command):
+    collection = command.get(command_name)
+    if not isinstance(collection, str):
+        collection = ''
+    spec = command.get(_SPEC_FIELDS.get(command_name, ''), None)
+    if command_name in ('update', 'delete') and spec:
+        spec = [s.get('q', {}) for s in spec]
+    return f'{command_name} {collection} {_mask(spec) if spec is not None else ""}'.strip()
+
+
+class RequestStats:
+    def __init__(self):
+        self.count = 0
+        self.duration_micros = 0
+        self.shapes = Counter()
+        self.pending = {}
+
+
+class RouteStats:
+    def __init__(self):
+        self.requests = 0
+        self.commands = 0
+        self.duration_micros = 0
+        self.max_commands = 0
+        self.flagged = 0
+        self.repeated_shapes = Counter()
+
+    def as_dict(self):
+        return {
+            'requests': self.requests,
+            'commands': self.commands,
+            'avg_commands': round(self.commands / self.requests, 2) if self.requests else 0,
+            'max_commands': self.max_commands,
+            'db_ms': round(self.duration_micros / 1000, 2),
+            'avg_db_ms': round(self.duration_micros / 1000 / self.requests, 3) if self.requests else 0,
+            'n_plus_one_requests': self.flagged,
+            'repeated_shapes': dict(self.repeated_shapes.most_common(5)),
+        }
+
+
+_routes_lock = threading.Lock()
+_routes = {}
+
+
+def current_stats():
+    """The RequestStats for the request being handled, if any."""
+    if not has_request_context():
+        return None
+    return g.get('mongo_stats')
+
+
+class CommandMonitor(monitoring.CommandListener):
+    """Feeds command events into the current request's RequestStats.
+
+    pymongo calls these synchronously on the thread that runs the command,
+    so ``flask.g`` belongs to the right request.
+    """
+
+    def started(self, event):
+        stats = current_stats()
+        if stats is not None:
+            stats.pending[event.request_id] = command_shape(event.command_name, event.command)
+
+    def _finish(self, event):
+        stats = current_stats()
+        if stats is None:
+            return
+        shape = stats.pending.pop(event.request_id, event.command_name)
+        stats.count += 1
+        stats.duration_micros += event.duration_micros
+        stats.shapes[shape] += 1
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event)
+
+
+listener = CommandMonitor()
+
+
+def _start_request():
+    g.mongo_stats = RequestStats()
+
+
+def _finish_request(response):
+    # Left on g so metrics.py can read the totals at teardown
+    stats = g.get('mongo_stats')
+    if stats is None:
+        return response
+
+    db_ms = stats.duration_micros / 1000
+    response.headers.add('Server-Timing', f'db;dur={db_ms:.2f};desc="{stats.count} queries"')
+
+    threshold = settings['MONGO_N_PLUS_ONE_THRESHOLD']
+    repeated = {shape: n for shape, n in stats.shapes.items() if n > threshold}
+
+    route = request.endpoint or request.path
+    with _routes_lock:
+        route_stats = _routes.setdefault(route, RouteStats())
+        route_stats.requests += 1
+        route_stats.commands += stats.count
+        route_stats.duration_micros += stats.duration_micros
+        route_stats.max_commands = max(route_stats.max_commands, stats.count)
+        if repeated:
+            route_stats.flagged += 1
+            route_stats.repeated_shapes.update(repeated)
+
+    if repeated:
+        message = f'N+1 queries in {route}: ' + '; '.join(f'{n}x {shape}' for shape, n in repeated.items())
+        logger.warning(message)
+        if settings['MONGO_N_PLUS_ONE_RAISE']:
+            raise NPlusOneError(message)
+    return response
+
+
+def route_summary():
+    with _routes_lock:
+        return {route: stats.as_dict() for route, stats in sorted(_routes.items())}
+
+
+def reset():
+    with _routes_lock:
+        _routes.clear()
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
@@ -0,0 +1,93 @@
+"""Whole-page cache for catalog pages, with ETags.
+
+Every visitor without pending flash messages gets the same HTML from the
+landing page, /main, /products and category pages: while a cached view runs
+the header is rendered without the visitor's name, admin link or cart count,
+which personalize.js fetches afterwards (see personalize.py). Views decorated
+with ``@cached_page`` keep that HTML in a per-worker LRU
+(PAGE_CACHE_SIZE entries, PAGE_CACHE_TTL_S) keyed by URL and catalog
+version, so a product or category write makes every stored page
+unreachable without any explicit purge.
+
+Cached pages carry a strong ETag (a hash of the body) and
+``Cache-Control: public, max-age=PAGE_CACHE_MAX_AGE_S, must-revalidate``.
+A request whose If-None-Match names the current page gets a 304 before
+the view runs, so neither MongoDB nor Jinja is touched; the only shared
+state consulted is the catalog version, which is re-read at most every
+CATALOG_VERSION_CHECK_S.
+
+Requests with flash messages waiting bypass the cache, as do responses
+that set session data.
+"""
+import hashlib
+from functools import wraps
+
+from flask import g, make_response, request, session
+
+import catalog_cache
+from catalog_cache import LRUCache
+
+settings = {
+    'PAGE_CACHE_ENABLED': True,
+    'PAGE_CACHE_SIZE': 512,
+    'PAGE_CACHE_TTL_S': 300.0,
+    'PAGE_CACHE_MAX_AGE_S': 0,
+}
+
+_cache = LRUCache(settings['PAGE_CACHE_SIZE'], settings['PAGE_CACHE_TTL_S'])
+
+
+class CachedPage:
+    """A stored response: body, content type and ETag."""
+
+    def __init__(self, body, mimetype):
+        self.body = body
+        self.mimetype = mimetype
+        self.etag = hashlib.sha1(body).hexdigest()
+
+
+def shareable():
+    return '_flashes' not in session
+
+
+def _respond(response, page, state):
+    response.set_etag(page.etag)
+    response.headers['Cache-Control'] = f"public, max-age={settings['PAGE_CACHE_MAX_AGE_S']}, must-revalidate"
+    response.headers['X-Page-Cache'] = state
+    # 304 without a body when If-None-Match names this page
+    return response.make_conditional(request)
+
+
+def cached_page(view):
+    """Serve ``view`` from the page cache."""
+    @wraps(view)
+    def wrap(*args, **kwargs):
+        if not settings['PAGE_CACHE_ENABLED'] or request.method not in ('GET', 'HEAD') or not shareable():
+            return view(*args, **kwargs)
+        key = (request.full_path, catalog_cache.version())
+        hit, page = _cache.get(key)
+        if hit:
+            response = make_response(page.body)
+            response.mimetype = page.mimetype
+            return _respond(response, page, 'hit')
+
+        g.page_cache = True
+        response = make_response(view(*args, **kwargs))
+        if response.status_code != 200 or session.modified or response.direct_passthrough:
+            return response
+        page = CachedPage(response.get_data(), response.mimetype)
+        _cache.set(key, page)
+        return _respond(response, page, 'miss')
+    return wrap
+
+
+def stats():
+    return _cache.stats()
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    _cache.maxsize = settings['PAGE_CACHE_SIZE']
+    _cache.ttl = settings['PAGE_CACHE_TTL_S']
@@ -0,0 +1,156 @@
+"""Keyset (cursor) pagination for product listings.
+
+A page is fetched with a range query on the sort key and _id, continuing
+from the last (or first) product of the page before, instead of skip(). With
+an index on ``(key, _id)`` (see init_db.py) page 500 costs the same as page 1.
+
+Cursors are opaque URL-safe tokens holding the sort order, the boundary
+product's sort value and _id, the direction and the page number to display.
+
+Product _ids are a mix of UUID strings and ObjectIds, and MongoDB only
+compares values of the same type with $gt/$lt, so the _id tie-break also
+matches the ids of the other type that sort after the boundary (BSON puts
+strings before ObjectIds). Products without the sort key (no ``created_at``
+on old products, say) sort as nulls, first ascending and last descending.
+"""
+import base64
+from datetime import datetime
+
+from bson import ObjectId, json_util
+
+# name -> (field, direction)
+SORTS = {
+    'name': ('name', 1),
+    'price': ('price', 1),
+    'newest': ('created_at', -1),
+}
+DEFAULT_SORT = 'name'
+
+# What a cursor's sort value and _id may be. They come from the client and go
+# straight into the query, so anything else (an operator document, a Regex
+# decoded from {"$regex": ...}) is refused.
+KEY_TYPES = (str, int, float, datetime, ObjectId, type(None))
+ID_TYPES = (str, int, ObjectId)
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(data):
+    raw = json_util.dumps(data, json_options=json_util.RELAXED_JSON_OPTIONS).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json_util.loads(raw)
+    except Exception:
+        raise InvalidCursor(token)
+    if (not isinstance(data, dict) or data.get('s') not in SORTS or data.get('d') not in ('next', 'prev')
+            or not isinstance(data.get('p'), int) or data['p'] < 1
+            or not isinstance(data.get('k'), KEY_TYPES) or not isinstance(data.get('i'), ID_TYPES)):
+        raise InvalidCursor(token)
+    return data
+
+
+def _ids_after(value, direction):
+    """Filter for _ids that come after ``value`` in ``direction`` order."""
+    op = '$gt' if direction == 1 else '$lt'
+    if direction == 1 and isinstance(value, str):
+        return {'$or': [{'_id': {op: value}}, {'_id': {'$type': 'objectId'}}]}
+    if direction == -1 and not isinstance(value, str):
+        return {'$or': [{'_id': {op: value}}, {'_id': {'$type': 'string'}}]}
+    return {'_id': {op: value}}
+
+
+def after(field, key, _id, direction):
+    """Filter for documents after (key, _id) when sorted by (field, _id) in ``direction``."""
+    op = '$gt' if direction == 1 else '$lt'
+    same_key = {'$and': [{field: key}, _ids_after(_id, direction)]}
+    if key is None:
+        # Nulls sort lowest: ascending, every real value comes next
+        return {'$or': [same_key, {field: {'$ne': None}}]} if direction == 1 else same_key
+    later = [same_key, {field: {op: key}}]
+    if direction == -1:
+        later.append({field: None})
+    return {'$or': later}
+
+
+class Page:
+    """One page of results with cursors (or, for offset paging, page numbers) for its neighbours.
+
+    Search results also carry their facet counts (see facets.py).
+    """
+
+    def __init__(self, items, number, sort, next_cursor=None, prev_cursor=None, pages=None,
+                 next_page=None, prev_page=None, facets=None):
+        self.items = items
+        self.number = number
+        self.sort = sort
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.pages = pages
+        self.next_page = next_page
+        self.prev_page = prev_page
+        self.facets = facets
+
+
+def paginate(collection, query, sort=DEFAULT_SORT, cursor=None, page_size=24, projection=None,
+             page=1, count=None):
+    """Fetch one page of ``collection`` matching ``query``.
+
+    Without a cursor the first page is returned, or page ``page`` through
+    skip() so old ``?page=N`` links keep working; the cursors in the result
+    continue from there with range queries. ``count`` is the total number of
+    matches, if the caller knows it cheaply. Raises InvalidCursor for a
+    token that doesn't decode.
+    """
+    if cursor:
+        state = decode_cursor(cursor)
+        sort = state['s']
+    elif sort not in SORTS:
+        sort = DEFAULT_SORT
+    field, direction = SORTS[sort]
+    if projection is not None:
+        # The next cursor needs the sort value of the last product
+        projection = dict(projection, **{field: 1})
+    pages = max(-(-count // page_size), 1) if count is not None else None
+
+    if cursor:
+        number = state['p']
+        # Walking back runs the same query in reverse from the page's first item
+        step = direction if state['d'] == 'next' else -direction
+        filters = [query, after(field, state['k'], state['i'], step)]
+        cursor_query = {'$and': [f for f in filters if f]}
+        skip = 0
+    else:
+        number = page if pages is None else min(page, pages)
+        step = direction
+        cursor_query = query
+        skip = (number - 1) * page_size
+
+    docs = list(collection.find(cursor_query, projection)
+                .sort([(field, step), ('_id', step)])
+                .skip(skip)
+                .limit(page_size + 1))
+    more = len(docs) > page_size
+    docs = docs[:page_size]
+    if step != direction:
+        docs.reverse()
+
+    def make(doc, towards, target):
+        return encode_cursor({'s': sort, 'k': doc.get(field), 'i': doc['_id'], 'd': towards, 'p': target})
+
+    going_back = bool(cursor) and state['d'] == 'prev'
+    has_next = going_back or more
+    has_prev = more if going_back else number > 1
+    return Page(
+        docs,
+        number,
+        sort,
+        next_cursor=make(docs[-1], 'next', number + 1) if docs and has_next else None,
+        prev_cursor=make(docs[0], 'prev', number - 1) if docs and has_prev else None,
+        pages=pages,
+    )
@@ -0,0 +1,71 @@
+"""The per-visitor parts of the page header, kept out of shared HTML.
+
+The header shows the visitor's name and email, an admin link for admins and
+a cart badge. Pages served from the page cache (page_cache.py) are shared by
+every visitor, so they are rendered with a neutral header: the guest links
+shown, the account and admin parts hidden and the badge empty. After the
+page loads, static/js/personalize.js fetches /fragments/header, a small
+private JSON document built from the session, and fills those parts in.
+Pages that are not cached still render the header on the server.
+
+The admin flag is re-read from MongoDB at most every ADMIN_RECHECK_S per
+session instead of on every render.
+"""
+import time
+
+from flask import g, jsonify, session
+
+from database import db
+
+settings = {
+    'ADMIN_RECHECK_S': 60.0,
+}
+
+
+def refresh_admin():
+    """Re-read the logged-in user's admin flag once it is ADMIN_RECHECK_S old."""
+    user = session.get('user')
+    if not user:
+        return
+    now = time.time()
+    if now - user.get('admin_checked_at', 0) < settings['ADMIN_RECHECK_S']:
+        return
+    doc = db.users.find_one({'_id': user['_id']}, {'is_admin': 1})
+    user['is_admin'] = bool(doc and doc.get('is_admin'))
+    user['admin_checked_at'] = now
+    session.modified = True
+
+
+def cart_count():
+    return sum(int(quantity) for quantity in session.get('cart', {}).values())
+
+
+def header_state():
+    refresh_admin()
+    user = session.get('user')
+    return {
+        'user': {'name': user.get('name', 'User'), 'email': user.get('email', '')} if user else None,
+        'is_admin': bool(user and user.get('is_admin')),
+        'cart_count': cart_count(),
+    }
+
+
+def header_fragment():
+    response = jsonify(header_state())
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+
+def inject_header():
+    if g.get('page_cache'):
+        # Shared HTML; personalize.js fills the header in
+        return {'hole_punch': True}
+    refresh_admin()
+    return {'hole_punch': False, 'cart_count': cart_count()}
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    app.context_processor(inject_header)
@@ -0,0 +1,49 @@
+"""Find products by any id they have had, in one query.
+
+Product ``_id``s come in three forms: UUID strings (add_product), other
+strings (/test/cart) and ObjectIds (older imports). migrate_product_ids.py
+moves every product to a UUID string and keeps its old ids in
+``legacy_ids``, so old links and carts keep working.
+
+A lookup is a single indexed query that covers all of that at once: ``_id``
+as a string or as an ObjectId, or a legacy id. find_products() does the same
+for a whole cart in one round trip.
+"""
+from bson import ObjectId
+
+from database import db
+
+
+def candidates(product_id):
+    """The ``_id`` values a product id from a URL or cart may be stored as."""
+    product_id = str(product_id)
+    return [product_id, ObjectId(product_id)] if ObjectId.is_valid(product_id) else [product_id]
+
+
+def lookup_filter(product_ids):
+    ids = [str(i) for i in product_ids]
+    values = [value for i in ids for value in candidates(i)]
+    return {'$or': [{'_id': {'$in': values}}, {'legacy_ids': {'$in': ids}}]}
+
+
+def find_products(product_ids, projection=None):
+    """{requested id: product} for the ids that exist, from one query."""
+    ids = {str(i) for i in product_ids}
+    if not ids:
+        return {}
+    if projection is not None:
+        projection = dict(projection, legacy_ids=1)
+    found = {}
+    for product in db.products.find(lookup_filter(ids), projection):
+        for known in [str(product['_id'])] + list(product.get('legacy_ids') or []):
+            if known in ids:
+                found[known] = product
+    return found
+
+
+def find_product(product_id, projection=None):
+    return find_products([product_id], projection).get(str(product_id))
+
+
+def create_index():
+    db.products.create_index('legacy_ids', sparse=True)
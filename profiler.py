@@ -0,0 +1,220 @@
+"""Opt-in sampling profiler for a fraction of requests.
+
+When PROFILER_ENABLED is set, the middleware picks requests at random
+(PROFILER_SAMPLE_RATE, or a per-route rate from PROFILER_ROUTE_RATES such as
+``/user/admin/orders=1,/success=0.5``) and a background thread samples the
+stack of the thread serving each picked request every PROFILER_INTERVAL_MS.
+Each profiled request is written to PROFILER_OUTPUT_DIR as a collapsed-stack
+(``.folded``) file, the input format of flamegraph.pl and speedscope:
+
+    flamegraph.pl 1712345678-1234-GET-%2Fmain-84.2ms.folded > main.svg
+
+/admin/profiles lists the slowest recent profiles from every worker.
+
+Not available with gevent workers: a greenlet's id is not a thread id, so
+its stack never shows up in sys._current_frames() and every profile would
+come back empty. init_app() logs a warning and leaves the profiler off.
+"""
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from urllib.parse import quote, unquote
+
+from flask import Blueprint, abort, render_template, send_from_directory
+
+from decorators import admin_required
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'PROFILER_ENABLED': False,
+    'PROFILER_SAMPLE_RATE': 0.01,
+    'PROFILER_ROUTE_RATES': '',
+    'PROFILER_INTERVAL_MS': 5,
+    'PROFILER_OUTPUT_DIR': '/tmp/shimplyshop-profiles',
+    'PROFILER_KEEP': 200,
+}
+
+_FILE_RE = re.compile(r'^(?P<ts>\d+)-(?P<pid>\d+)-(?P<method>[A-Z]+)-(?P<path>.*)-(?P<ms>[\d.]+)ms\.folded$')
+
+
+def parse_route_rates(value):
+    """'/a=1,/b=0.5' -> [('/a', 1.0), ('/b', 0.5)], longest prefix first."""
+    rates = []
+    for part in filter(None, (p.strip() for p in value.split(','))):
+        prefix, _, rate = part.partition('=')
+        rates.append((prefix.strip(), float(rate)))
+    return sorted(rates, key=lambda r: len(r[0]), reverse=True)
+
+
+def _frame_label(frame):
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_name}"
+
+
+def collapse(frame, limit=128):
+    """Root-first ``a;b;c`` stack string for a frame."""
+    labels = []
+    while frame is not None and len(labels) < limit:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(labels))
+
+
+class StackSampler:
+    """One background thread that samples every thread being profiled."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._active = {}
+        self._wake = threading.Event()
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Threads don't survive fork, so start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='stack-sampler', daemon=True).start()
+                self._pid = os.getpid()
+
+    def start(self, ident):
+        self._ensure_thread()
+        counts = Counter()
+        with self._lock:
+            self._active[ident] = counts
+        self._wake.set()
+        return counts
+
+    def stop(self, ident):
+        with self._lock:
+            return self._active.pop(ident, Counter())
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+            if idle:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for ident, counts in self._active.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counts[collapse(frame)] += 1
+            time.sleep(self.interval)
+
+
+class SamplingProfiler:
+    """WSGI middleware that profiles a random subset of requests."""
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+        self.default_rate = float(settings['PROFILER_SAMPLE_RATE'])
+        self.route_rates = parse_route_rates(settings['PROFILER_ROUTE_RATES'])
+        self.output_dir = settings['PROFILER_OUTPUT_DIR']
+        self.keep = int(settings['PROFILER_KEEP'])
+        self.sampler = StackSampler(settings['PROFILER_INTERVAL_MS'] / 1000)
+        os.makedirs(self.output_dir, exist_ok=True)
+
+    def rate_for(self, path):
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.default_rate
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '/')
+        if random.random() >= self.rate_for(path):
+            return self.wsgi_app(environ, start_response)
+
+        ident = threading.get_ident()
+        self.sampler.start(ident)
+        started = time.perf_counter()
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            counts = self.sampler.stop(ident)
+            if counts:
+                self.write(environ.get('REQUEST_METHOD', 'GET'), path, duration_ms, counts)
+
+    def write(self, method, path, duration_ms, counts):
+        name = f'{int(time.time())}-{os.getpid()}-{method}-{quote(path[:100], safe="")}-{duration_ms:.1f}ms.folded'
+        with open(os.path.join(self.output_dir, name), 'w') as f:
+            for stack, count in counts.most_common():
+                f.write(f'{stack} {count}\n')
+        self.prune()
+
+    def prune(self):
+        files = sorted(f for f in os.listdir(self.output_dir) if f.endswith('.folded'))
+        for name in files[:-self.keep]:
+            try:
+                os.remove(os.path.join(self.output_dir, name))
+            except OSError:
+                pass
+
+
+def recent_profiles():
+    """Profiles on disk (all workers), slowest first."""
+    output_dir = settings['PROFILER_OUTPUT_DIR']
+    if not os.path.isdir(output_dir):
+        return []
+    profiles = []
+    for name in os.listdir(output_dir):
+        match = _FILE_RE.match(name)
+        if match:
+            profiles.append({
+                'file': name,
+                'time': int(match.group('ts')),
+                'pid': int(match.group('pid')),
+                'method': match.group('method'),
+                'path': unquote(match.group('path')),
+                'duration_ms': float(match.group('ms')),
+            })
+    return sorted(profiles, key=lambda p: p['duration_ms'], reverse=True)
+
+
+profiler_bp = Blueprint('profiler', __name__)
+
+
+@profiler_bp.route('/profiles')
+@admin_required
+def profiles():
+    return render_template('admin/profiles.html',
+                           profiles=recent_profiles()[:50],
+                           enabled=settings['PROFILER_ENABLED'])
+
+
+@profiler_bp.route('/profiles/<name>')
+@admin_required
+def download_profile(name):
+    if not _FILE_RE.match(name):
+        abort(404)
+    return send_from_directory(settings['PROFILER_OUTPUT_DIR'], name,
+                               mimetype='text/plain', as_attachment=True)
+
+
+def gevent_active():
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    if settings['PROFILER_ENABLED'] and gevent_active():
+        logger.warning('PROFILER_ENABLED is ignored under gevent workers: greenlet stacks cannot be sampled')
+        settings['PROFILER_ENABLED'] = False
+    if settings['PROFILER_ENABLED']:
+        app.wsgi_app = SamplingProfiler(app.wsgi_app)
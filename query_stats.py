@@ -0,0 +1,136 @@
+"""How often each search query is asked, in fixed memory.
+
+Every search is added to a per-worker count-min sketch (SKETCH_DEPTH rows
+of SKETCH_WIDTH counters), which decides which queries are worth counting
+exactly: one whose estimate reaches the smallest of the current
+SEARCH_STATS_TOP takes its place. Every SEARCH_STATS_FLUSH_S a background
+thread adds the exact counts to ``search_queries`` in MongoDB and starts a
+fresh sketch; head_queries() reads them to keep the most asked searches warm
+in the search index's result cache.
+
+Counts are kept for normalized queries (see search_index.normalize()), so
+"Aloo  Bhujia" and "bhujia aloo" count as one.
+"""
+import hashlib
+import logging
+import os
+import threading
+import time
+from array import array
+
+from pymongo import DESCENDING, UpdateOne
+
+from database import db
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'SEARCH_STATS_FLUSH_S': 60.0,
+    'SEARCH_STATS_TOP': 100,
+}
+
+SKETCH_WIDTH = 2048
+SKETCH_DEPTH = 4
+
+
+def cells(item, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+    """The counter ``item`` falls in on each row."""
+    digest = hashlib.blake2b(item.encode(), digest_size=4 * depth).digest()
+    return [int.from_bytes(digest[4 * row:4 * row + 4], 'little') % width for row in range(depth)]
+
+
+class CountMinSketch:
+    """Approximate counts that never undercount; overcounts stay within a fraction of the total."""
+
+    def __init__(self, width=SKETCH_WIDTH, depth=SKETCH_DEPTH):
+        self.width = width
+        self.depth = depth
+        self.rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+        self.total = 0
+
+    def add(self, item, count=1):
+        estimate = None
+        for row, cell in enumerate(cells(item, self.width, self.depth)):
+            self.rows[row][cell] += count
+            value = self.rows[row][cell]
+            estimate = value if estimate is None else min(estimate, value)
+        self.total += count
+        return estimate
+
+
+class QueryStats:
+    """This worker's query counts since the last flush."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self.sketch = CountMinSketch()
+        self.top = {}
+        self.flushed_at = None
+
+    def record(self, query):
+        if not query:
+            return
+        with self._lock:
+            estimate = self.sketch.add(query)
+            if query in self.top:
+                self.top[query] += 1
+            elif len(self.top) < settings['SEARCH_STATS_TOP']:
+                self.top[query] = estimate
+            else:
+                # Swap out the least asked query once this one overtakes it
+                smallest = min(self.top, key=self.top.get)
+                if estimate > self.top[smallest]:
+                    del self.top[smallest]
+                    self.top[query] = estimate
+
+    def flush(self):
+        with self._lock:
+            top = self.top
+            self.sketch, self.top = CountMinSketch(), {}
+        if not top:
+            return
+        db.search_queries.bulk_write(
+            [UpdateOne({'_id': query}, {'$inc': {'count': count}}, upsert=True) for query, count in top.items()],
+            ordered=False,
+        )
+        self.flushed_at = time.time()
+
+    def ensure_thread(self):
+        # Threads don't survive fork, so start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='search-stats', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            time.sleep(settings['SEARCH_STATS_FLUSH_S'])
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Flushing search query stats failed')
+
+
+stats = QueryStats()
+
+
+def record(query):
+    stats.ensure_thread()
+    stats.record(query)
+
+
+def head_queries(limit=None):
+    """[(query, count)] for the most asked searches across all workers."""
+    limit = limit or settings['SEARCH_STATS_TOP']
+    return [(doc['_id'], doc['count'])
+            for doc in db.search_queries.find().sort('count', DESCENDING).limit(limit)]
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
@@ -0,0 +1,167 @@
+"""Product search: the in-memory index, or MongoDB's text index.
+
+With SEARCH_MODE=memory (the default) searches are answered from
+search_index.py without touching MongoDB; until the index is built, and for
+links carrying a cursor from a Mongo-backed page, they use the text index.
+
+Text searches use the weighted ``product_text`` index (name counts five
+times as much as description, see init_db.py) and rank by text score, so a
+search costs an index lookup instead of a regex scan of every product. Input is
+reduced to plain words before it reaches Mongo: quotes and ``-`` have no
+special meaning and nothing is interpreted as a regex.
+
+SEARCH_MODE=regex searches with escaped case-insensitive regexes instead,
+one per word (no index needed; it scans). Text mode falls back to the same regex when the
+text index is missing, and, if SEARCH_REGEX_FALLBACK is on, when the text
+search finds nothing (the text index matches whole stemmed words, so
+"bhuj" only finds "bhujia" through the fallback).
+
+Queries are normalized first (search_index.normalize(): case-folded words,
+each once, sorted), so word order and spacing don't change the results and
+every spelling of a query shares one cache entry. Mongo-backed pages are
+cached in the catalog cache under the normalized query.
+"""
+import logging
+import re
+
+from pymongo.errors import OperationFailure
+
+import catalog_cache
+import facets
+import search_index
+from database import db
+from pagination import Page, paginate
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'SEARCH_MODE': 'memory',
+    'SEARCH_REGEX_FALLBACK': True,
+}
+
+INDEX_NAME = 'product_text'
+INDEX_WEIGHTS = {'name': 10, 'description': 2}
+RELEVANCE = 'relevance'
+MAX_TERMS = 10
+# "text index required for $text query"
+_INDEX_NOT_FOUND = 27
+
+_state = {'index_missing': False}
+
+
+def create_index():
+    db.products.create_index(
+        [(field, 'text') for field in INDEX_WEIGHTS],
+        weights=INDEX_WEIGHTS,
+        name=INDEX_NAME,
+        default_language='english',
+    )
+
+
+def terms(query):
+    return re.findall(r'\w+', query.lower())[:MAX_TERMS]
+
+
+def text_filter(query):
+    words = terms(query)
+    return {'$text': {'$search': ' '.join(words)}} if words else None
+
+
+def regex_filter(query, fields=('name', 'description')):
+    """Every word of ``query`` somewhere in one of ``fields``, ignoring case."""
+    clauses = [{'$or': [{field: {'$regex': re.escape(word), '$options': 'i'}} for field in fields]}
+               for word in query.split()]
+    return {'$and': clauses} if clauses else {}
+
+
+def _use_text():
+    return settings['SEARCH_MODE'] in ('memory', 'text') and not _state['index_missing']
+
+
+def _index_missing(error):
+    if error.code != _INDEX_NOT_FOUND:
+        raise error
+    if not _state['index_missing']:
+        logger.warning(f'No text index on products ({error}); searching with regex. Run init_db.py to create it.')
+    _state['index_missing'] = True
+
+
+def _ranked_page(query_filter, page, page_size, projection):
+    """Page ``page`` of text matches, best first (offset paging: score isn't a range key)."""
+    score = {'$meta': 'textScore'}
+    projection = dict(projection or {}, score=score)
+    docs = list(db.products.find(query_filter, projection)
+                .sort([('score', score), ('_id', 1)])
+                .skip((page - 1) * page_size)
+                .limit(page_size + 1))
+    more = len(docs) > page_size
+    return Page(docs[:page_size], page, RELEVANCE,
+                next_page=page + 1 if more else None,
+                prev_page=page - 1 if page > 1 else None)
+
+
+def _filtered(query_filter, filters):
+    extra = facets.mongo_filter(filters)
+    return {'$and': [query_filter, extra]} if extra else query_filter
+
+
+def search_page(query, sort=None, cursor=None, page=1, page_size=24, projection=None, filters=None):
+    """One page of products matching ``query`` and ``filters``, with facet counts.
+
+    Sorted by relevance unless ``sort`` names one of the pagination sorts, in
+    which case it pages with cursors like the other listings.
+    """
+    filters = filters or {}
+    query = search_index.normalize(query)
+    if not query:
+        return Page([], 1, sort or RELEVANCE, facets=facets.build({}, {}, 0, filters))
+    if not cursor:
+        result = search_index.search_page(query, sort=sort, page=page, page_size=page_size, filters=filters)
+        if result is not None:
+            return result
+    key = ('search', query, sort, cursor, page, page_size, tuple(sorted(filters.items())))
+    return catalog_cache.cached(key, lambda: _mongo_page(query, sort, cursor, page, page_size, projection, filters))
+
+
+def _mongo_page(query, sort, cursor, page, page_size, projection, filters):
+    if _use_text():
+        query_filter = text_filter(query)
+        if query_filter is None:
+            return Page([], 1, sort or RELEVANCE, facets=facets.build({}, {}, 0, filters))
+        try:
+            if sort in (None, '', RELEVANCE) and not cursor:
+                result = _ranked_page(_filtered(query_filter, filters), page, page_size, projection)
+            else:
+                result = paginate(db.products, _filtered(query_filter, filters), sort=sort, cursor=cursor,
+                                  page_size=page_size, projection=projection, page=page)
+            # An empty page under filters isn't a reason to fall back
+            if result.items or filters or not settings['SEARCH_REGEX_FALLBACK']:
+                result.facets = facets.mongo_facets(db.products, query_filter, filters)
+                return result
+        except OperationFailure as e:
+            _index_missing(e)
+    if sort in (None, '', RELEVANCE):
+        sort = None
+    query_filter = regex_filter(query)
+    result = paginate(db.products, _filtered(query_filter, filters), sort=sort, cursor=cursor,
+                      page_size=page_size, projection=projection, page=page)
+    result.facets = facets.mongo_facets(db.products, query_filter, filters)
+    return result
+
+
+def find_all(query, sort=(('name', 1),)):
+    """Every matching product (for the admin dashboard filter)."""
+    if _use_text() and terms(query):
+        try:
+            products = list(db.products.find(text_filter(query)).sort(list(sort)))
+            if products or not settings['SEARCH_REGEX_FALLBACK']:
+                return products
+        except OperationFailure as e:
+            _index_missing(e)
+    return list(db.products.find(regex_filter(query)).sort(list(sort)))
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
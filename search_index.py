@@ -0,0 +1,512 @@
+"""In-memory inverted index over the catalog for search and typeahead.
+
+Each worker tokenizes every product's name, category and description into
+a term -> {product: weight} map (name 10, category 5, description 2) and
+keeps the terms sorted, so a prefix is a bisect plus a short scan. Product
+cards are kept alongside, so /search and /search/suggest answer without
+touching MongoDB.
+
+The index is built in a background thread when the worker starts (see
+gunicorn_config.py) or on first use; until it is ready search falls back to
+MongoDB. After that it follows catalog writes through the catalog version
+(catalog_cache.changed_products()): only the products a write touched are
+reloaded, and the whole index is rebuilt in the background when the change
+log doesn't reach back far enough.
+
+Words that match nothing are matched fuzzily: every indexed term's
+trigrams go into trigram -> term-id arrays (array('I'), built with the index
+and extended when a write adds new terms), and a misspelt word is compared
+with the terms that share its rarest trigrams. The scan stops after
+FUZZY_SCAN_LIMIT postings, so "did you mean" costs the same however large the
+catalog is; terms at least SEARCH_FUZZY_THRESHOLD similar (shared / all
+trigrams) count as matches, weighted by similarity.
+
+Ranked result ids are cached per normalized query (case-folded words, each
+once, sorted: "Bhujia  aloo" and "aloo bhujia" are one entry), sort and
+filters in an LRU of SEARCH_QUERY_CACHE_SIZE entries, so every page of a
+result and each infinite-scroll fetch slice one ranking. Entries belong to
+an index version and are dropped when a write moves it. After a build or a
+write, the most asked queries (query_stats.head_queries()) are ranked again
+in the background so they stay hot.
+
+Popularity is units ordered over the last SEARCH_POPULARITY_DAYS, read when
+the index is built. Memory grows with the catalog (roughly a few hundred
+bytes per product per worker); use SEARCH_MODE=text for very large catalogs.
+"""
+import bisect
+import heapq
+from array import array
+import logging
+import os
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+
+import catalog_cache
+import facets
+import product_ids
+import query_stats
+from catalog_cache import LRUCache
+from database import db
+from pagination import SORTS, Page
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'SEARCH_MODE': 'memory',
+    'SEARCH_POPULARITY_DAYS': 30,
+    'SEARCH_SUGGEST_LIMIT': 8,
+    'SEARCH_SUGGEST_MIN_CHARS': 2,
+    'SEARCH_FUZZY_THRESHOLD': 0.4,
+    'SEARCH_QUERY_CACHE_SIZE': 1024,
+    'SEARCH_QUERY_CACHE_TTL_S': 600.0,
+    'SEARCH_WARM_QUERIES': 50,
+}
+
+FIELD_WEIGHTS = {'name': 10, 'category': 5, 'description': 2}
+# Fields kept per product: what a card shows, plus the sort and facet keys
+CARD_FIELDS = ('name', 'price', 'main_image', 'image_id', 'image', 'category', 'created_at', 'stock', 'version')
+# A prefix matches at most this many distinct terms
+MAX_EXPANSIONS = 64
+# Matches on a prefix of a word count this much of an exact match
+PREFIX_FACTOR = 0.5
+# Trigram postings read per fuzzy lookup, and terms compared in full
+FUZZY_SCAN_LIMIT = 20000
+FUZZY_CANDIDATES = 50
+# Fuzzy terms used per misspelt word
+FUZZY_TERMS = 3
+# Wait this long before trying again after a failed build
+RETRY_S = 30.0
+# Same name as search.RELEVANCE
+RELEVANCE = 'relevance'
+
+
+def tokens(text):
+    return re.findall(r'\w+', text.casefold()) if isinstance(text, str) else []
+
+
+def normalize(query):
+    """The cache and statistics key for a query: its words, each once, sorted."""
+    return ' '.join(sorted(set(tokens(query))))
+
+
+def trigrams(term):
+    padded = f'  {term} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def similarity(a, b):
+    """Shared trigrams over all trigrams of the two words (0 to 1)."""
+    a, b = trigrams(a), trigrams(b)
+    return len(a & b) / len(a | b)
+
+
+def _card(product):
+    card = {'_id': product['_id']}
+    for field in CARD_FIELDS:
+        if field in product:
+            card[field] = product[field]
+    if isinstance(card.get('main_image'), dict):
+        card['main_image'] = {'id': card['main_image'].get('id')}
+    return card
+
+
+def _sort_key(card, field):
+    # Missing values first, like Mongo's nulls; mixed types compare as text
+    value = card.get(field)
+    if value is None:
+        return (0, '')
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, datetime):
+        return (2, value)
+    return (3, str(value).lower())
+
+
+def load_popularity(days):
+    """Units ordered per product id over the last ``days`` days."""
+    since = datetime.utcnow() - timedelta(days=days)
+    pipeline = [
+        {'$match': {'created_at': {'$gte': since}}},
+        {'$unwind': '$items'},
+        {'$match': {'items.product_id': {'$ne': None}}},
+        {'$group': {'_id': '$items.product_id', 'units': {'$sum': {'$ifNull': ['$items.quantity', 1]}}}},
+    ]
+    return {str(doc['_id']): doc['units'] for doc in db.orders.aggregate(pipeline, allowDiskUse=True)}
+
+
+class ProductIndex:
+    """Postings, sorted terms and product cards for one worker."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._start_lock = threading.Lock()
+        self._pid = None
+        self._building = False
+        self._attempted_at = 0.0
+        self.version = None
+        self.ready = False
+        self.postings = {}
+        self.terms = []
+        self.cards = {}
+        self.doc_terms = {}
+        self.popularity = {}
+        # Term ids only grow; removed terms keep their id until the next rebuild
+        self.term_ids = {}
+        self.term_list = []
+        self.trigram_postings = {}
+        self.results = LRUCache(settings['SEARCH_QUERY_CACHE_SIZE'], settings['SEARCH_QUERY_CACHE_TTL_S'])
+        self.built_at = None
+        self.build_seconds = None
+        self.updates = 0
+
+    # Building -------------------------------------------------------------
+
+    def ensure_built(self):
+        """Start a background build in this process if there is no index yet."""
+        if settings['SEARCH_MODE'] != 'memory':
+            return
+        # Threads and indexes don't survive fork, so each worker builds its own
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._building = False
+                self._start_build()
+
+    def _start_build(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+            self._attempted_at = time.monotonic()
+        threading.Thread(target=self._build, name='search-index', daemon=True).start()
+
+    def _build(self):
+        try:
+            self.rebuild()
+        except Exception:
+            logger.exception('Building the search index failed')
+        finally:
+            self._building = False
+        self.warm()
+
+    def warm(self):
+        """Rank the most asked queries so their first search after a change is a cache hit."""
+        if not self.ready:
+            return
+        try:
+            head = query_stats.head_queries(settings['SEARCH_WARM_QUERIES'])
+        except Exception as e:
+            logger.warning(f'Search index: no head queries to warm ({e})')
+            return
+        for query, _ in head:
+            self.results_for(query)
+
+    def rebuild(self):
+        """Load every product into a fresh index and swap it in."""
+        started = time.perf_counter()
+        version = catalog_cache.version()
+        try:
+            popularity = load_popularity(settings['SEARCH_POPULARITY_DAYS'])
+        except Exception as e:
+            logger.warning(f'Search index: no popularity data ({e})')
+            popularity = {}
+        fresh = ProductIndex()
+        fresh.popularity = popularity
+        projection = {field: 1 for field in CARD_FIELDS + ('description',)}
+        for product in db.products.find({}, projection):
+            fresh._add(product)
+        fresh.terms = sorted(fresh.postings)
+        for term in fresh.terms:
+            fresh._add_term(term)
+        with self._lock:
+            self.postings = fresh.postings
+            self.terms = fresh.terms
+            self.cards = fresh.cards
+            self.doc_terms = fresh.doc_terms
+            self.term_ids = fresh.term_ids
+            self.term_list = fresh.term_list
+            self.trigram_postings = fresh.trigram_postings
+            self.results.clear()
+            self.popularity = popularity
+            self.version = version
+            self.ready = True
+            self.built_at = time.time()
+            self.build_seconds = round(time.perf_counter() - started, 3)
+        logger.info(f'Search index: {len(self.cards)} products, {len(self.terms)} terms in {self.build_seconds}s')
+
+    def _add(self, product):
+        key = str(product['_id'])
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in tokens(product.get(field)):
+                weights[term] = max(weights.get(term, 0), weight)
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[key] = weight
+        self.doc_terms[key] = list(weights)
+        self.cards[key] = _card(product)
+        return weights
+
+    def _add_term(self, term):
+        if term in self.term_ids:
+            return
+        term_id = self.term_ids[term] = len(self.term_list)
+        self.term_list.append(term)
+        for gram in trigrams(term):
+            ids = self.trigram_postings.get(gram)
+            if ids is None:
+                ids = self.trigram_postings[gram] = array('I')
+            ids.append(term_id)
+
+    def _remove(self, key):
+        for term in self.doc_terms.pop(key, ()):
+            docs = self.postings.get(term)
+            if docs is None:
+                continue
+            docs.pop(key, None)
+            if not docs:
+                del self.postings[term]
+                i = bisect.bisect_left(self.terms, term)
+                if i < len(self.terms) and self.terms[i] == term:
+                    del self.terms[i]
+        self.cards.pop(key, None)
+
+    def _apply(self, ids, products):
+        with self._lock:
+            for key in ids:
+                self._remove(key)
+            for product in products:
+                for term in self._add(product):
+                    i = bisect.bisect_left(self.terms, term)
+                    if i == len(self.terms) or self.terms[i] != term:
+                        self.terms.insert(i, term)
+                        self._add_term(term)
+            self.updates += 1
+
+    def refresh(self):
+        """Catch up with catalog writes made since the index was built.
+
+        Returns False while there is no usable index yet, and always outside
+        SEARCH_MODE=memory, where no index is built.
+        """
+        if settings['SEARCH_MODE'] != 'memory':
+            return False
+        self.ensure_built()
+        if not self.ready:
+            if not self._building and time.monotonic() - self._attempted_at > RETRY_S:
+                self._start_build()
+            return False
+        version, ids = catalog_cache.changed_products(self.version)
+        if version == self.version:
+            return True
+        if ids is None:
+            # Too far behind to patch; keep answering from this one meanwhile
+            self._start_build()
+            return True
+        products = self._load(ids)
+        with self._lock:
+            if self.version == version:
+                return True
+            self._apply(ids, products)
+            self.version = version
+            self.results.clear()
+        threading.Thread(target=self.warm, name='search-warm', daemon=True).start()
+        return True
+
+    @staticmethod
+    def _load(ids):
+        projection = {field: 1 for field in CARD_FIELDS + ('description',)}
+        lookup = [value for i in ids for value in product_ids.candidates(i)]
+        return list(db.products.find({'_id': {'$in': lookup}}, projection))
+
+    # Queries --------------------------------------------------------------
+
+    def _expand(self, prefix):
+        """Indexed terms starting with ``prefix``, the exact term first."""
+        i = bisect.bisect_left(self.terms, prefix)
+        found = []
+        while i < len(self.terms) and len(found) < MAX_EXPANSIONS and self.terms[i].startswith(prefix):
+            found.append(self.terms[i])
+            i += 1
+        return found
+
+    def _has_prefix(self, word):
+        i = bisect.bisect_left(self.terms, word)
+        return i < len(self.terms) and self.terms[i].startswith(word)
+
+    def fuzzy(self, word, limit=FUZZY_TERMS):
+        """[(term, similarity)] for the indexed terms closest to ``word``, best first."""
+        grams = trigrams(word)
+        with self._lock:
+            # Rarest trigrams first, so the scan budget goes where it discriminates
+            lists = sorted((self.trigram_postings[g] for g in grams if g in self.trigram_postings), key=len)
+            shared = {}
+            budget = FUZZY_SCAN_LIMIT
+            for ids in lists:
+                if budget <= 0:
+                    break
+                for term_id in ids[:budget]:
+                    shared[term_id] = shared.get(term_id, 0) + 1
+                budget -= len(ids)
+            candidates = heapq.nlargest(FUZZY_CANDIDATES, shared, key=shared.get)
+            terms = [self.term_list[i] for i in candidates]
+            terms = [t for t in terms if t in self.postings and abs(len(t) - len(word)) <= max(2, len(word) // 3)]
+        threshold = settings['SEARCH_FUZZY_THRESHOLD']
+        scored = [(term, similarity(word, term)) for term in terms]
+        scored = [(term, score) for term, score in scored if score >= threshold and term != word]
+        scored.sort(key=lambda pair: (-pair[1], -len(self.postings.get(pair[0], ())), pair[0]))
+        return scored[:limit]
+
+    def _term_scores(self, word):
+        scores = {}
+        expansions = [(term, 1.0 if term == word else PREFIX_FACTOR) for term in self._expand(word)]
+        if not expansions:
+            # Nothing starts with it: try the words it is probably a typo of
+            expansions = [(term, score * PREFIX_FACTOR) for term, score in self.fuzzy(word)]
+        for term, factor in expansions:
+            for key, weight in self.postings.get(term, {}).items():
+                score = weight * factor
+                if score > scores.get(key, 0):
+                    scores[key] = score
+        return scores
+
+    def did_you_mean(self, query):
+        """``query`` with unknown words replaced by their closest terms, or None if all are known."""
+        words = tokens(query)
+        corrected = []
+        for word in words:
+            with self._lock:
+                known = self._has_prefix(word)
+            close = None if known else self.fuzzy(word, limit=1)
+            corrected.append(close[0][0] if close else word)
+        return ' '.join(corrected) if corrected != words else None
+
+    def match(self, query):
+        """{product key: score} for products matching every word of ``query`` (as a prefix)."""
+        words = tokens(query)
+        if not words:
+            return {}
+        with self._lock:
+            per_word = sorted((self._term_scores(word) for word in dict.fromkeys(words)), key=len)
+        matches = dict(per_word[0])
+        for scores in per_word[1:]:
+            matches = {key: score + scores[key] for key, score in matches.items() if key in scores}
+            if not matches:
+                break
+        return matches
+
+    def results_for(self, query, sort=None, filters=None):
+        """(ranked product keys, facet counts) for a query, cached per normalized query.
+
+        Matches are filtered and facet-counted in the same pass.
+        """
+        filters = filters or {}
+        sort = sort if sort in SORTS else RELEVANCE
+        cache_key = (self.version, normalize(query), sort, tuple(sorted(filters.items())))
+        hit, value = self.results.get(cache_key)
+        if hit:
+            return value
+        matches = self.match(query)
+        counter = facets.Counter(filters)
+        with self._lock:
+            cards, popularity = self.cards, self.popularity
+            keys = [key for key in matches if key in cards and counter.add(cards[key])]
+            if sort in SORTS:
+                field, direction = SORTS[sort]
+                keys.sort(key=lambda k: (_sort_key(cards[k], field), k), reverse=direction == -1)
+            else:
+                keys.sort(key=lambda k: (-matches[k], -popularity.get(k, 0), _sort_key(cards[k], 'name')))
+        value = (keys, counter.result())
+        self.results.set(cache_key, value)
+        return value
+
+    def search_page(self, query, sort=None, page=1, page_size=24, filters=None):
+        """One page of matches (offset paging; everything is in memory)."""
+        keys, counts = self.results_for(query, sort, filters)
+        pages = max(-(-len(keys) // page_size), 1)
+        page = min(page, pages)
+        start = (page - 1) * page_size
+        cards = self.cards
+        items = [cards[k] for k in keys[start:start + page_size] if k in cards]
+        return Page(items, page, sort if sort in SORTS else RELEVANCE, pages=pages,
+                    next_page=page + 1 if page < pages else None,
+                    prev_page=page - 1 if page > 1 else None,
+                    facets=counts)
+
+    def suggest(self, query, limit=8):
+        """Products for a search box prefix, most ordered first."""
+        matches = self.match(query)
+        with self._lock:
+            cards, popularity = self.cards, self.popularity
+            best = heapq.nlargest(limit, (key for key in matches if key in cards),
+                                  key=lambda k: (popularity.get(k, 0), matches[k]))
+            return [cards[key] for key in best]
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'building': self._building,
+            'version': self.version,
+            'products': len(self.cards),
+            'terms': len(self.terms),
+            'built_at': self.built_at,
+            'build_seconds': self.build_seconds,
+            'incremental_updates': self.updates,
+            'popular_products': len(self.popularity),
+            'trigrams': len(self.trigram_postings),
+            'query_cache': self.results.stats(),
+        }
+
+
+index = ProductIndex()
+
+
+def search_page(query, sort=None, page=1, page_size=24, filters=None):
+    """A Page from the index, or None if it isn't in use or isn't built yet."""
+    if settings['SEARCH_MODE'] != 'memory' or not index.refresh():
+        return None
+    return index.search_page(query, sort=sort, page=page, page_size=page_size, filters=filters)
+
+
+def did_you_mean(query):
+    """A corrected spelling of ``query`` from the index, or None."""
+    if settings['SEARCH_MODE'] != 'memory' or not index.refresh():
+        return None
+    return index.did_you_mean(query)
+
+
+def _mongo_suggest(query, limit):
+    # Anchored, case-sensitive prefixes are range scans on the name index;
+    # try the prefix as typed and capitalized
+    prefixes = {query, query[:1].upper() + query[1:]}
+    return list(db.products.find(
+        {'$or': [{'name': {'$regex': '^' + re.escape(prefix)}} for prefix in prefixes]},
+        {field: 1 for field in CARD_FIELDS},
+    ).sort('name', 1).limit(limit))
+
+
+def suggest(query):
+    """Typeahead matches for ``query``.
+
+    Outside SEARCH_MODE=memory, products whose name starts with ``query``;
+    in memory mode, empty until the index is built.
+    """
+    query = query.strip()
+    if len(query) < settings['SEARCH_SUGGEST_MIN_CHARS']:
+        return []
+    if settings['SEARCH_MODE'] != 'memory':
+        return _mongo_suggest(query, settings['SEARCH_SUGGEST_LIMIT'])
+    if not index.refresh():
+        return []
+    return index.suggest(query, limit=settings['SEARCH_SUGGEST_LIMIT'])
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+    index.results.maxsize = settings['SEARCH_QUERY_CACHE_SIZE']
+    index.results.ttl = settings['SEARCH_QUERY_CACHE_TTL_S']
@@ -0,0 +1,40 @@
+// On small screens, replace the Previous/Next links under a product listing
+// with infinite scroll: when the "Next" link comes into view, fetch the next
+// page's cards as JSON (?format=json) and append them.
+(function () {
+  const grid = document.querySelector('[data-infinite-scroll]');
+  const nav = document.querySelector('.pagination');
+  if (!grid || !nav || !('IntersectionObserver' in window)) return;
+  if (!window.matchMedia('(max-width: 768px)').matches) return;
+
+  let next = nav.querySelector('a[rel="next"]');
+  let loading = false;
+  if (!next) return;
+  next = next.href;
+
+  const observer = new IntersectionObserver(async (entries) => {
+    if (!entries[0].isIntersecting || loading || !next) return;
+    loading = true;
+    try {
+      const url = new URL(next);
+      url.searchParams.set('format', 'json');
+      const response = await fetch(url, { headers: { Accept: 'application/json' } });
+      if (!response.ok) throw new Error(response.statusText);
+      const data = await response.json();
+      grid.insertAdjacentHTML('beforeend', data.html);
+      next = data.next;
+      // Keep the address bar on the last loaded page so reloads land there
+      history.replaceState(null, '', url.pathname + url.search.replace(/[?&]format=json/, ''));
+      if (!next) observer.disconnect();
+    } catch (e) {
+      // Fall back to the plain links
+      observer.disconnect();
+      nav.style.visibility = 'visible';
+    } finally {
+      loading = false;
+    }
+  }, { rootMargin: '400px' });
+
+  nav.style.visibility = 'hidden';
+  observer.observe(nav);
+})();
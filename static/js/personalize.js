@@ -0,0 +1,35 @@
+// Pages served from the page cache are the same for every visitor, so their
+// header comes without a name, admin link or cart count. Fetch those from
+// /fragments/header and fill them in.
+(function () {
+  if (!document.body.hasAttribute('data-hole-punch') || !window.fetch) return;
+
+  function fill(name, value) {
+    document.querySelectorAll('[data-personal="' + name + '"]').forEach((el) => {
+      el.textContent = value;
+    });
+  }
+
+  function show(selector, visible) {
+    document.querySelectorAll(selector).forEach((el) => {
+      el.hidden = !visible;
+    });
+  }
+
+  fetch('/fragments/header', { credentials: 'same-origin', headers: { Accept: 'application/json' } })
+    .then((response) => (response.ok ? response.json() : null))
+    .then((state) => {
+      if (!state) return;
+      show('[data-if-user]', !!state.user);
+      show('[data-if-guest]', !state.user);
+      show('[data-if-admin]', state.is_admin);
+      if (state.user) {
+        fill('name', state.user.name);
+        fill('email', state.user.email);
+      }
+      document.querySelectorAll('[data-personal="cart-count"]').forEach((el) => {
+        el.textContent = state.cart_count || (el.classList.contains('cart-count') ? 0 : '');
+      });
+    })
+    .catch(() => {});
+})();
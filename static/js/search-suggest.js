@@ -0,0 +1,92 @@
+// Typeahead for the header search box: after a short pause in typing, ask
+// /search/suggest for matching products and list them under the input.
+// Arrow keys move through the list, Enter opens the highlighted product and
+// Escape closes it; with nothing highlighted the form submits as usual.
+(function () {
+  const form = document.querySelector('.header-search-bar');
+  const input = form && form.querySelector('input[name="q"]');
+  if (!input || !window.fetch) return;
+
+  const list = document.createElement('ul');
+  list.className = 'search-suggestions';
+  list.hidden = true;
+  form.appendChild(list);
+  input.setAttribute('autocomplete', 'off');
+
+  let timer = null;
+  let latest = 0;
+  let active = -1;
+
+  function close() {
+    list.hidden = true;
+    list.innerHTML = '';
+    active = -1;
+  }
+
+  function highlight(index) {
+    const items = list.querySelectorAll('a');
+    if (!items.length) return;
+    active = (index + items.length) % items.length;
+    items.forEach((item, i) => item.classList.toggle('active', i === active));
+  }
+
+  function show(suggestions) {
+    close();
+    suggestions.forEach((product) => {
+      const link = document.createElement('a');
+      link.href = product.url;
+      link.textContent = product.name;
+      if (product.price != null) {
+        const price = document.createElement('span');
+        price.className = 'price';
+        price.textContent = '₹' + Number(product.price).toFixed(2);
+        link.appendChild(price);
+      }
+      const item = document.createElement('li');
+      item.appendChild(link);
+      list.appendChild(item);
+    });
+    list.hidden = !suggestions.length;
+  }
+
+  async function fetchSuggestions(query) {
+    const request = ++latest;
+    try {
+      const response = await fetch('/search/suggest?q=' + encodeURIComponent(query));
+      if (!response.ok) return;
+      const data = await response.json();
+      // Answers can arrive out of order; only the newest one counts
+      if (request === latest) show(data.suggestions);
+    } catch (e) {
+      close();
+    }
+  }
+
+  input.addEventListener('input', () => {
+    clearTimeout(timer);
+    const query = input.value.trim();
+    if (query.length < 2) {
+      latest++;
+      close();
+      return;
+    }
+    timer = setTimeout(() => fetchSuggestions(query), 120);
+  });
+
+  input.addEventListener('keydown', (event) => {
+    if (list.hidden) return;
+    if (event.key === 'ArrowDown' || event.key === 'ArrowUp') {
+      event.preventDefault();
+      highlight(active + (event.key === 'ArrowDown' ? 1 : -1));
+    } else if (event.key === 'Enter' && active >= 0) {
+      event.preventDefault();
+      window.location = list.querySelectorAll('a')[active].href;
+    } else if (event.key === 'Escape') {
+      close();
+    }
+  });
+
+  document.addEventListener('click', (event) => {
+    if (!form.contains(event.target)) close();
+  });
+})();
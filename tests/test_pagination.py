@@ -0,0 +1,45 @@
+import unittest
+from datetime import datetime
+
+from bson import ObjectId
+
+from pagination import InvalidCursor, decode_cursor, encode_cursor
+
+
+def cursor(**fields):
+    data = {'s': 'name', 'k': 'Aloo Bhujia', 'i': 'a1b2', 'd': 'next', 'p': 2}
+    data.update(fields)
+    return encode_cursor(data)
+
+
+class DecodeCursorTest(unittest.TestCase):
+    def test_round_trip(self):
+        for key, _id in [('Aloo', 'a1b2'), (12.5, ObjectId()), (None, 'x'),
+                         (datetime(2024, 5, 1), ObjectId())]:
+            data = decode_cursor(cursor(k=key, i=_id))
+            self.assertEqual((data['k'], data['i']), (key, _id))
+
+    def test_operator_document_key_is_refused(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor(k={'$where': 'sleep(1000)'}))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor(k={'$regex': '.*', '$options': 's'}))
+
+    def test_operator_document_id_is_refused(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor(i={'$ne': None}))
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(cursor(i=['a', 'b']))
+
+    def test_missing_id_is_refused(self):
+        data = {'s': 'name', 'k': 'Aloo', 'd': 'next', 'p': 2}
+        with self.assertRaises(InvalidCursor):
+            decode_cursor(encode_cursor(data))
+
+    def test_garbage_is_refused(self):
+        with self.assertRaises(InvalidCursor):
+            decode_cursor('not a cursor')
+
+
+if __name__ == '__main__':
+    unittest.main()
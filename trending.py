@@ -0,0 +1,230 @@
+"""Trending products, folded in from new orders as they arrive.
+
+Each unit ordered counts towards its product with exponential time decay
+(half-life TRENDING_HALF_LIFE_DAYS). Scores are stored forward-decayed: a
+unit ordered at time t adds 2 ** ((t - epoch) / half-life), so ordering by
+``score`` ranks products by decayed units at any moment and existing scores
+never need rewriting. Only when the exponent grows too large are all scores
+scaled down and the epoch moved.
+
+Every TRENDING_REFRESH_S a background thread in each worker tries to take a
+lease on ``trending_state``; the one that gets it adds the orders placed
+since the last refresh, up to SETTLE_S ago, to ``trending`` ({_id: product
+id, score}) and drops products whose decayed score has fallen below
+TRENDING_MIN_UNITS. The lease is extended before every batch, so a long
+backfill keeps it, and a worker that has lost it stops without writing.
+Reading the ranking is one indexed query (top()). After changing the
+half-life, run ``python trending.py --rebuild``.
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+import product_ids
+from database import db
+
+logger = logging.getLogger(__name__)
+
+settings = {
+    'TRENDING_HALF_LIFE_DAYS': 7.0,
+    'TRENDING_WINDOW_DAYS': 60,
+    'TRENDING_REFRESH_S': 300.0,
+    'TRENDING_MIN_UNITS': 0.01,
+}
+
+STATE_ID = 'trending'
+BATCH = 5000
+# Rebase scores before 2 ** exponent gets anywhere near float overflow
+MAX_EXPONENT = 256
+# Order ids are made by the client before the insert, so a worker can commit
+# an order with a smaller id after a refresh has read past it. Only orders
+# older than this are folded in; later ones wait for the next refresh.
+SETTLE_S = 30
+
+
+def _exponent(when, epoch):
+    return (when - epoch).total_seconds() / (settings['TRENDING_HALF_LIFE_DAYS'] * 86400)
+
+
+def _order_time(order):
+    created = order.get('created_at')
+    if isinstance(created, datetime):
+        return created.replace(tzinfo=None)
+    return order['_id'].generation_time.replace(tzinfo=None)
+
+
+def _claim(owner):
+    """The state document if ``owner`` got the refresh lease, else None."""
+    now = time.time()
+    try:
+        return db.trending_state.find_one_and_update(
+            {'_id': STATE_ID, 'lease_until': {'$lt': now}},
+            {'$set': {'lease_until': now + settings['TRENDING_REFRESH_S'], 'owner': owner}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+    except DuplicateKeyError:
+        # Another worker holds the lease
+        return None
+
+
+def _hold(owner, **fields):
+    """Extend ``owner``'s lease and set ``fields``; False if the lease has passed to another worker."""
+    fields['lease_until'] = time.time() + settings['TRENDING_REFRESH_S']
+    return db.trending_state.update_one({'_id': STATE_ID, 'owner': owner}, {'$set': fields}).matched_count == 1
+
+
+def _rebase(epoch, now):
+    if _exponent(now, epoch) < MAX_EXPONENT:
+        return epoch
+    db.trending.update_many({}, {'$mul': {'score': 2 ** -_exponent(now, epoch)}})
+    db.trending_state.update_one({'_id': STATE_ID}, {'$set': {'epoch': now}})
+    return now
+
+
+def _fold(orders, epoch):
+    """Add a batch of orders' units to the scores of the products they name."""
+    weights = defaultdict(float)
+    for order in orders:
+        weight = 2 ** _exponent(_order_time(order), epoch)
+        for item in order.get('items') or []:
+            if isinstance(item, dict) and item.get('product_id'):
+                weights[str(item['product_id'])] += weight * (item.get('quantity') or 1)
+    # Count under current ids; ids that aren't products (deleted, or
+    # Stripe's own from older orders) are dropped
+    scores = defaultdict(float)
+    for requested, product in product_ids.find_products(weights, {'_id': 1}).items():
+        scores[str(product['_id'])] += weights[requested]
+    if scores:
+        db.trending.bulk_write(
+            [UpdateOne({'_id': product_id}, {'$inc': {'score': score}}, upsert=True)
+             for product_id, score in scores.items()],
+            ordered=False,
+        )
+
+
+def refresh():
+    """Fold in orders placed since the last refresh. False if another worker is at it."""
+    owner = uuid.uuid4().hex
+    state = _claim(owner)
+    if state is None:
+        return False
+    try:
+        now = datetime.utcnow()
+        epoch = _rebase(state.get('epoch') or now, now)
+        last_id = state.get('last_order_id') or ObjectId.from_datetime(
+            now - timedelta(days=settings['TRENDING_WINDOW_DAYS']))
+        settled = ObjectId.from_datetime(now - timedelta(seconds=SETTLE_S))
+        while True:
+            orders = list(db.orders.find(
+                {'_id': {'$gt': last_id, '$lt': settled}},
+                {'created_at': 1, 'items.product_id': 1, 'items.quantity': 1},
+            ).sort('_id', 1).limit(BATCH))
+            if not orders:
+                break
+            if not _hold(owner):
+                logger.warning('Trending refresh lost its lease; stopping')
+                return True
+            _fold(orders, epoch)
+            last_id = orders[-1]['_id']
+            # A crash before this line counts the batch again on the next refresh
+            if not _hold(owner, last_order_id=last_id, epoch=epoch):
+                logger.warning('Trending refresh lost its lease; stopping')
+                return True
+            if len(orders) < BATCH:
+                break
+        floor = settings['TRENDING_MIN_UNITS'] * 2 ** _exponent(now, epoch)
+        db.trending.delete_many({'score': {'$lt': floor}})
+        _hold(owner, epoch=epoch, refreshed_at=now)
+    finally:
+        db.trending_state.update_one({'_id': STATE_ID, 'owner': owner}, {'$set': {'lease_until': 0}})
+    return True
+
+
+def rebuild():
+    """Recompute the ranking from the last TRENDING_WINDOW_DAYS of orders."""
+    db.trending.delete_many({})
+    db.trending_state.delete_one({'_id': STATE_ID})
+    refresh()
+
+
+def top(limit):
+    """Ids of the ``limit`` most trending products, best first."""
+    return [doc['_id'] for doc in db.trending.find({}, {'_id': 1}).sort('score', DESCENDING).limit(limit)]
+
+
+def create_index():
+    db.trending.create_index([('score', DESCENDING)])
+
+
+class Refresher:
+    def __init__(self):
+        self._start_lock = threading.Lock()
+        self._pid = None
+
+    def ensure_thread(self):
+        # Threads don't survive fork, so start one per worker process
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                threading.Thread(target=self._run, name='trending', daemon=True).start()
+                self._pid = os.getpid()
+
+    def _run(self):
+        while True:
+            try:
+                refresh()
+            except Exception:
+                logger.exception('Refreshing trending products failed')
+            time.sleep(settings['TRENDING_REFRESH_S'])
+
+
+refresher = Refresher()
+
+
+def stats():
+    state = db.trending_state.find_one({'_id': STATE_ID}) or {}
+    return {
+        'products': db.trending.estimated_document_count(),
+        'last_order_id': str(state.get('last_order_id')) if state.get('last_order_id') else None,
+        'refreshed_at': state['refreshed_at'].isoformat() if state.get('refreshed_at') else None,
+        'epoch': state['epoch'].isoformat() if state.get('epoch') else None,
+        'refresher_running': refresher._pid == os.getpid(),
+    }
+
+
+def init_app(app):
+    for key in settings:
+        if key in app.config:
+            settings[key] = app.config[key]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rebuild', action='store_true', help='start over from the last TRENDING_WINDOW_DAYS of orders')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        create_index()
+        if args.rebuild:
+            rebuild()
+        elif not refresh():
+            print('Another worker is refreshing; try again shortly')
+            return
+        print(f"{db.trending.estimated_document_count()} trending products")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 from flask import Flask, render_template, jsonify, request, session, redirect
 from passlib.hash import pbkdf2_sha256
 import uuid
-from app import db
+from database import db
 
 class User:
 
@@ -1,6 +1,6 @@
 from bson import ObjectId
 from datetime import datetime
-from app import db
+from database import db
 
 class Order:
     STATUS_CHOICES = [
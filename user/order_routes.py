@@ -2,61 +2,12 @@ from flask import Blueprint, render_template, jsonify, request, redirect, url_fo
 from functools import wraps
 from bson import ObjectId
 from .order_models import Order
-from app import db, login_required
+from database import db
+from decorators import login_required, admin_required
 import logging
 
 order_bp = Blueprint('order', __name__)
 
-def admin_required(f):
-    @wraps(f)
-    def wrap(*args, **kwargs):
-        try:
-            # Check if user is logged in
-            if 'user' not in session:
-                flash('Please log in to access this page', 'danger')
-                return redirect(url_for('login_page'))
-            
-            # Get user ID from session
-            user_data = session['user']
-            user_id = user_data.get('_id')
-            
-            if not user_id:
-                flash('Invalid user session', 'danger')
-                return redirect(url_for('login_page'))
-            
-            # First try to find user by _id as is (could be string or ObjectId)
-            user = None
-            
-            # Try direct match first
-            user = db.users.find_one({'_id': user_id})
-            
-            # If not found and it looks like an ObjectId, try converting
-            if not user and ObjectId.is_valid(str(user_id)):
-                user = db.users.find_one({'_id': ObjectId(user_id)})
-            
-            # If still not found, try by email as fallback
-            if not user and 'email' in user_data:
-                user = db.users.find_one({'email': user_data['email']})
-                if user:
-                    # Update session with correct _id
-                    session['user']['_id'] = str(user['_id'])
-            
-            # Check if user is admin
-            if user and user.get('is_admin'):
-                # Update session with fresh user data
-                user['_id'] = str(user['_id'])  # Ensure _id is a string
-                session['user'] = {**session['user'], **user}
-                return f(*args, **kwargs)
-            
-            # If we get here, user is not an admin
-            flash('Admin access required. Please log in with an administrator account.', 'danger')
-            return redirect(url_for('dashboard'))
-        except Exception as e:
-            current_app.logger.error(f'Admin check failed: {str(e)}', exc_info=True)
-            flash('An error occurred while verifying your access. Please try again.', 'danger')
-            return redirect(url_for('dashboard'))
-    return wrap
-
 @order_bp.route('/order/<order_id>/print', methods=['GET'])
 @admin_required
 def print_invoice(order_id):
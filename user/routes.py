@@ -1,21 +1,26 @@
 import os
 import base64
-from flask import session, redirect, url_for, render_template, request, flash, send_from_directory
-from app import app, db
+from flask import session, redirect, url_for, render_template, request, flash, send_from_directory, current_app
+from database import db, fs
 from user.models import User
 import uuid
 from bson import ObjectId, Binary
 from bson.binary import Binary
-import re
 from werkzeug.utils import secure_filename
-from gridfs import GridFS, NoFile
+from gridfs import NoFile
 from io import BytesIO
-from flask import send_file, abort
-from pymongo import MongoClient
-from gridfs import GridFS
-
-# Initialize GridFS
-fs = GridFS(db)
+from flask import send_file, abort, Response, jsonify
+from datetime import datetime
+from pagination import InvalidCursor, SORTS, paginate
+import catalog_cache
+import search as product_search
+import search_index
+import facets
+import query_stats
+import trending
+from page_cache import cached_page
+from filters import slugify
+from pymongo.errors import DuplicateKeyError
 
 def get_image(image_id):
     try:
@@ -26,7 +31,6 @@ def get_image(image_id):
         return None
 
 
-@app.route('/user/signup', methods=['POST'])
 def signup():
     from user.models import User
     user_model = User()
@@ -35,11 +39,9 @@ def signup():
         return render_template('signup.html', signup_error=result['error'], login_error=None)
     return redirect('/main')
 
-@app.route('/user/signout')
 def signout():
     return User().signout()
     
-@app.route('/user/login', methods=['GET', 'POST'])
 def login():
     from user.models import User
     user_model = User()
@@ -51,24 +53,42 @@ def login():
     return redirect('/main')
 
 
-@app.route('/main')
+# Only what a product card shows, plus its version for the card cache (see
+# fragments.py); descriptions and galleries stay in Mongo
+LISTING_FIELDS = {'name': 1, 'price': 1, 'main_image.id': 1, 'image_id': 1, 'image': 1, 'version': 1}
+TRENDING_COUNT = 8
+
+
+def get_page():
+    try:
+        return max(int(request.args.get('page', 1)), 1)
+    except ValueError:
+        return 1
+
+
+def trending_products():
+    # Room for products deleted since the ranking was last refreshed
+    ids = trending.top(TRENDING_COUNT * 2)
+    found = catalog_cache.get_products(ids)
+    products = [found[i] for i in ids if i in found][:TRENDING_COUNT]
+    if len(products) < TRENDING_COUNT:
+        # Too few orders yet; fill the strip with other products
+        shown = [product['_id'] for product in products]
+        products += db.products.find({'_id': {'$nin': shown}}, LISTING_FIELDS).limit(TRENDING_COUNT - len(products))
+    return products
+
+
+@cached_page
 def main():
-    products = list(db.products.find())
-    categories = list(db.categories.find())
-    return render_template('main.html', products=products, categories=categories)
+    trending.refresher.ensure_thread()
+    products = catalog_cache.cached(('trending',), trending_products)
+    return render_template('main.html', products=products)
 
-@app.route('/add_to_cart/<product_id>', methods=['POST'])
 def add_to_cart(product_id):
     try:
         cart = session.get('cart', {})
         
-        # First try to find the product with the exact ID (string match)
-        product = db.products.find_one({'_id': product_id})
-        
-        # If not found and it looks like a UUID, try with ObjectId as fallback
-        if not product and ObjectId.is_valid(product_id):
-            product = db.products.find_one({'_id': ObjectId(product_id)})
-            
+        product = catalog_cache.get_product(product_id)
         if not product:
             flash('Product not found', 'error')
             return redirect(request.referrer or url_for('main'))
@@ -84,25 +104,29 @@ def add_to_cart(product_id):
         return redirect(request.referrer or url_for('main'))
         
     except Exception as e:
-        app.logger.error(f"Error adding to cart: {str(e)}", exc_info=True)
+        current_app.logger.error(f"Error adding to cart: {str(e)}", exc_info=True)
         flash('An error occurred while adding the item to your cart', 'error')
         return redirect(request.referrer or url_for('main'))
 
-@app.route('/cart')
 def cart():
     cart = session.get('cart', {})
     products = []
     total = 0
-    
+
+    # The whole cart in one lookup
+    found = catalog_cache.get_products(cart)
+    canonical = {key: str(found[key]['_id']) for key in cart if key in found}
+    if any(key != product_id for key, product_id in canonical.items()):
+        # Carts from before migrate_product_ids.py: key them by current ids
+        merged = {}
+        for key, qty in cart.items():
+            merged[canonical.get(key, key)] = merged.get(canonical.get(key, key), 0) + qty
+        cart = session['cart'] = merged
+        found = {canonical.get(key, key): product for key, product in found.items()}
+
     for product_id, qty in cart.items():
         try:
-            # Try to find the product with the exact ID first
-            product = db.products.find_one({"_id": product_id})
-            
-            # If not found and it looks like an ObjectId, try that
-            if not product and ObjectId.is_valid(product_id):
-                product = db.products.find_one({"_id": ObjectId(product_id)})
-                
+            product = found.get(product_id)
             if product:
                 # Ensure we use the string version of the ID for consistency
                 product = dict(product)  # Create a mutable copy
@@ -112,22 +136,15 @@ def cart():
                 total += product['subtotal']
                 products.append(product)
         except Exception as e:
-            app.logger.error(f"Error loading product {product_id}: {str(e)}", exc_info=True)
+            current_app.logger.error(f"Error loading product {product_id}: {str(e)}", exc_info=True)
             continue
-    
-    # Get categories for the sidebar
-    categories = list(db.categories.find())
-    
-    # Get Stripe public key from config
-    from app import stripe_public_key  # Import from app.py
+
     
     return render_template('cart.html', 
                          products=products, 
                          total=total,
-                         categories=categories,
-                         stripe_public_key=stripe_public_key)
+                         stripe_public_key=current_app.config['STRIPE_PUBLIC_KEY'])
 
-@app.route('/remove_from_cart/<product_id>', methods=['POST'])
 def remove_from_cart(product_id):
     try:
         cart = session.get('cart', {})
@@ -147,12 +164,11 @@ def remove_from_cart(product_id):
             flash('Item not found in cart', 'error')
             
     except Exception as e:
-        app.logger.error(f"Error removing from cart: {str(e)}")
+        current_app.logger.error(f"Error removing from cart: {str(e)}")
         flash('An error occurred while removing the item from your cart', 'error')
         
     return redirect(url_for('cart'))
 
-@app.route('/update_cart/<product_id>', methods=['POST'])
 def update_cart(product_id):
     try:
         cart = session.get('cart', {})
@@ -180,7 +196,7 @@ def update_cart(product_id):
     except ValueError:
         flash('Invalid quantity', 'error')
     except Exception as e:
-        app.logger.error(f"Error updating cart: {str(e)}")
+        current_app.logger.error(f"Error updating cart: {str(e)}")
         flash('An error occurred while updating your cart', 'error')
         
     return redirect(url_for('cart'))
@@ -211,7 +227,6 @@ def save_uploaded_file(file, file_type='image'):
     )
     return str(file_id)
 
-@app.route('/admin/add_product', methods=['GET','POST'])
 def add_product():
     if request.method == 'POST':
         # Check if main image is provided
@@ -274,18 +289,19 @@ def add_product():
                 'id': video_id,
                 'content_type': video_content_type
             } if video_id else None,
-            "category": category
+            "category": category,
+            "created_at": datetime.utcnow(),
+            "version": 1
         }
         
         db.products.insert_one(product)
+        catalog_cache.invalidate([product['_id']])
         flash('Product added successfully!', 'success')
         return redirect(url_for('admin_dashboard'))
     
     # GET request - show the form
-    categories = list(db.categories.find())
-    return render_template('add_product.html', categories=categories)
+    return render_template('add_product.html')
 
-@app.route('/image/<image_id>')
 def serve_image(image_id):
     if image_id == 'placeholder':
         # Serve the placeholder image
@@ -298,10 +314,9 @@ def serve_image(image_id):
             mimetype=grid_out.content_type
         )
     except Exception as e:
-        app.logger.error(f"Error serving image {image_id}: {str(e)}")
+        current_app.logger.error(f"Error serving image {image_id}: {str(e)}")
         abort(404)
 
-@app.route('/video/<video_id>')
 def serve_video(video_id):
     try:
         grid_out = fs.get(ObjectId(video_id))
@@ -344,11 +359,10 @@ def serve_video(video_id):
         return response
         
     except Exception as e:
-        app.logger.error(f"Error serving video {video_id}: {str(e)}")
+        current_app.logger.error(f"Error serving video {video_id}: {str(e)}")
         abort(404)
 
 
-@app.route('/check-admin')
 def check_admin_status():
     if 'user' not in session:
         return 'Not logged in', 401
@@ -376,32 +390,78 @@ def check_admin_status():
     
     return f'{user_email} is already an admin', 200
 
-@app.route('/products')
+def listing_url(**changes):
+    """This listing's URL with some query arguments replaced (None drops one)."""
+    args = request.args.to_dict()
+    args.pop('format', None)
+    args.update(changes)
+    args = {k: v for k, v in args.items() if v is not None}
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def product_page(query, count=None):
+    """Keyset-paginated listing for the current request's sort/cursor/page args.
+
+    ``count`` is an optional function returning the number of matches. Pages
+    are cached per query and arguments until the catalog changes.
+    """
+    sort = request.args.get('sort')
+    cursor = request.args.get('cursor')
+    page_size = current_app.config['PRODUCTS_PAGE_SIZE']
+    page = get_page()
+
+    def load():
+        return paginate(db.products, query, sort=sort, cursor=cursor, page_size=page_size,
+                        projection=LISTING_FIELDS, page=page, count=count() if count else None)
+
+    key = ('listing', repr(query), sort, cursor, page, page_size)
+    try:
+        return catalog_cache.cached(key, load)
+    except InvalidCursor:
+        abort(400)
+
+
+def neighbour_url(cursor, number):
+    if cursor:
+        return listing_url(cursor=cursor, page=None, sort=None)
+    if number:
+        return listing_url(page=number, cursor=None)
+    return None
+
+
+def render_listing(template, page, sorts=tuple(SORTS), **context):
+    """Render a product listing, or just its cards as JSON for infinite scroll."""
+    next_url = neighbour_url(page.next_cursor, page.next_page)
+    prev_url = neighbour_url(page.prev_cursor, page.prev_page)
+    if request.args.get('format') == 'json':
+        return jsonify(
+            html=render_template('_product_cards.html', products=page.items),
+            next=next_url,
+            page=page.number,
+        )
+    sort_urls = {name: listing_url(sort=name, cursor=None, page=None) for name in sorts}
+    return render_template(template, products=page.items, page=page, next_url=next_url,
+                           prev_url=prev_url, sort_urls=sort_urls, **context)
+
+
+@cached_page
 def all_products():
-    products = list(db.products.find())
-    categories = list(db.categories.find())
-    return render_template('all_products.html', products=products, categories=categories)
+    page = product_page({}, count=db.products.estimated_document_count)
+    return render_listing('all_products.html', page)
 
 def is_admin():
     user = session.get('user')
     return user and user.get('is_admin', False)
 
-@app.route('/admin/dashboard')
 def admin_dashboard():
     if not is_admin():
         flash('Admin access required.')
         return redirect(url_for('main'))
     q = request.args.get('q', '').strip()
     if q:
-        products = list(db.products.find({
-            "$or": [
-                {"name": {"$regex": q, "$options": "i"}},
-                {"description": {"$regex": q, "$options": "i"}}
-            ]
-        }).sort("name", 1))  # Sort by name in ascending order
+        products = product_search.find_all(q)  # Sorted by name
     else:
         products = list(db.products.find().sort("name", 1))  # Sort by name in ascending order
-    categories = list(db.categories.find().sort("name", 1)) if hasattr(db, 'categories') else []  # Also sort categories alphabetically
     
     # Calculate total inventory value
     total_inventory_value = sum(product.get('price', 0) * product.get('stock', 0) for product in products)
@@ -412,34 +472,35 @@ def admin_dashboard():
     
     return render_template('admin_dashboard.html', 
                          products=products, 
-                         categories=categories,
                          total_inventory_value=total_inventory_value,
                          product_count=product_count,
                          total_stock=total_stock)
 
-@app.route('/session/')
 def show_session():
     return f"<pre>{dict(session)}</pre>"
 
-@app.route('/admin/remove_product/<product_id>', methods=['POST'])
 def remove_product(product_id):
     if not is_admin():
         flash('Admin access required.')
         return redirect(url_for('main'))
     db.products.delete_one({'_id': product_id})
+    catalog_cache.invalidate([product_id])
     return redirect(url_for('admin_dashboard'))
 
-@app.route('/admin/add_category', methods=['POST'])
 def add_category():
     if not is_admin():
         flash('Admin access required.')
         return redirect(url_for('main'))
-    name = request.form.get('category_name')
+    name = (request.form.get('category_name') or '').strip()
     if name:
-        db.categories.insert_one({'name': name})
+        try:
+            db.categories.insert_one({'name': name, 'slug': slugify(name)})
+        except DuplicateKeyError:
+            flash(f'A category with the URL /category/{slugify(name)} already exists.')
+            return redirect(url_for('admin_dashboard'))
+        catalog_cache.invalidate(product_ids=())
     return redirect(url_for('admin_dashboard'))
 
-@app.route('/admin/remove_category/<category_id>', methods=['POST'])
 def remove_category(category_id):
     if not is_admin():
         flash('Admin access required.')
@@ -448,39 +509,75 @@ def remove_category(category_id):
         db.categories.delete_one({'_id': ObjectId(category_id)})
     except Exception:
         db.categories.delete_one({'_id': category_id})
+    catalog_cache.invalidate(product_ids=())
     return redirect(url_for('admin_dashboard'))
 
-@app.route('/search')
 def search():
     query = request.args.get('q', '').strip()
     if not query:
         return redirect(url_for('main'))
-    # Search products by name or description (case-insensitive)
-    products = list(db.products.find({
-        "$or": [
-            {"name": {"$regex": query, "$options": "i"}},
-            {"description": {"$regex": query, "$options": "i"}}
-        ]
-    }))
-    categories = list(db.categories.find({
-        "name": {"$regex": query, "$options": "i"}
-    }))
-    return render_template('search_results.html', products=products, categories=categories, query=query)
-
-@app.route('/category/<category_name>')
+    # In-memory index (or MongoDB's text index) over products, best matches first
+    sort = request.args.get('sort')
+    cursor = request.args.get('cursor')
+    page_size = current_app.config['PRODUCTS_PAGE_SIZE']
+    page_number = get_page()
+    filters = facets.parse(request.args)
+    # Results are cached per normalized query inside search
+    try:
+        page = product_search.search_page(query, sort=sort, cursor=cursor, page=page_number, page_size=page_size,
+                                          projection=LISTING_FIELDS, filters=filters)
+    except InvalidCursor:
+        abort(400)
+    if page_number == 1 and not cursor and request.args.get('format') != 'json':
+        # Count searches, not the pages and scroll fetches that follow them
+        query_stats.record(search_index.normalize(query))
+    # Categories come from the in-memory snapshot; no query needed
+    needle = query.lower()
+    matching_categories = [c for c in catalog_cache.get_categories() if needle in c['name'].lower()]
+    return render_listing('search_results.html', page, sorts=(product_search.RELEVANCE, *SORTS),
+                          matching_categories=matching_categories, query=query,
+                          did_you_mean=search_index.did_you_mean(query),
+                          facets=facet_links(page.facets) if page.facets else None)
+
+def facet_links(counts):
+    """Facet counts with the URL that turns each one on or off (cached counts stay untouched)."""
+    def link(name, entry, value):
+        return dict(entry, url=listing_url(**{name: None if entry['selected'] else value}, cursor=None, page=None))
+    return {
+        'category': [link('category', entry, entry['value']) for entry in counts['category']],
+        'price': [link('price', entry, entry['value']) for entry in counts['price']],
+        'in_stock': link('in_stock', counts['in_stock'], '1'),
+    }
+
+def search_suggest():
+    """Typeahead: products matching the typed prefix, most ordered first."""
+    query = request.args.get('q', '')
+    suggestions = [{
+        'id': str(product['_id']),
+        'name': product.get('name'),
+        'price': product.get('price'),
+        'url': url_for('product_detail', product_id=str(product['_id'])),
+    } for product in search_index.suggest(query)]
+    response = jsonify(query=query, suggestions=suggestions)
+    response.headers['Cache-Control'] = 'public, max-age=30'
+    return response
+
+def find_category(slug):
+    category = db.categories.find_one({'slug': slug})
+    if category is None:
+        # Categories not yet migrated (see migrate_category_slugs.py)
+        category = next((c for c in catalog_cache.get_categories()
+                         if not c.get('slug') and slugify(c['name']) == slug), None)
+    return category
+
+
+@cached_page
 def category_page(category_name):
-    # Normalize category name for matching (case-insensitive, spaces/dashes)
-    def normalize(name):
-        return re.sub(r'[-\s]+', '-', name.strip().lower())
-    # Find the category by normalized name
-    categories = list(db.categories.find())
-    selected_category = None
-    for cat in categories:
-        if normalize(cat['name']) == category_name:
-            selected_category = cat
-            break
+    # One indexed lookup on the stored slug
+    selected_category = catalog_cache.cached(('category', category_name), lambda: find_category(category_name))
     if not selected_category:
         return "Category not found", 404
     # Find products in this category
-    products = list(db.products.find({"category": selected_category['name']}))
-    return render_template('category.html', category=selected_category, products=products, categories=categories)
\ No newline at end of file
+    query = {"category": selected_category['name']}
+    page = product_page(query, count=lambda: db.products.count_documents(query))
+    return render_listing('category.html', page, category=selected_category)
\ No newline at end of file